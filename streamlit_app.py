@@ -2,28 +2,21 @@ import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import io
+import ast
 import json
+import time
+import uuid
+from collections import Counter, deque
 from datetime import datetime
 
-from utils.tagging_functions import (
-    tag_pii_messages,
-    tag_aml_transactions,
-    tag_regulatory_obligations,
-)
-from utils.semantic_layer_builder import (
-    build_dbt_core_layer,
-    build_dbt_faiss_hybrid_layer,
-)
-from utils.agent_builder import (
-    create_agent_without_layer,
-    create_agent_with_layer,
-    create_agent_with_vector_layer,
-    create_agent_without_layer_with_trace,
-    create_agent_with_layer_with_trace,
-    create_agent_with_vector_layer_with_trace,
-)
+# Heavy modules (plotly, Azure/OpenAI tagging clients, FAISS, agent builders)
+# are imported where they are first used so the first paint stays fast.
 
-import plotly.express as px
+try:
+    import orjson
+except ImportError:  # optional speed-up for the Master JSON export
+    orjson = None
 
 load_dotenv()
 
@@ -36,6 +29,14 @@ st.set_page_config(
     layout="wide",
 )
 
+# Session-state log buffers, initialised once per session. Ring buffers keep
+# memory and the expanders' "\n".join bounded over long sessions.
+MAX_LOG_LINES = 200
+
+for _log_key in ("tagging_logs", "semantic_logs", "agent_logs"):
+    if _log_key not in st.session_state:
+        st.session_state[_log_key] = deque(maxlen=MAX_LOG_LINES)
+
 st.markdown(
     """
     <style>
@@ -86,6 +87,22 @@ st.markdown(
     "for PII, AML and regulatory intelligence."
 )
 
+# ---------------------------------------------------------------------
+# Helper: cached download payloads (reused across reruns)
+# ---------------------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode()
+
+
+@st.cache_data(show_spinner=False)
+def _to_xlsx_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize a tagged DataFrame to Excel only when a download is rendered."""
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
 # ---------------------------------------------------------------------
 # Sidebar – Data uploads and exports
 # ---------------------------------------------------------------------
@@ -104,71 +121,117 @@ with st.sidebar:
         "Regulatory Paragraphs CSV", type="csv", key="reg_upload"
     )
 
-    # Helper: tagging logs
+    # Helper: tagging logs (append to the bounded session deques)
+    def _append_log(key: str, msg: str):
+        st.session_state[key].append(f"{time.strftime('%H:%M:%S')} | {msg}")
+
     def log_tagging(msg: str):
-        logs = st.session_state.setdefault("tagging_logs", [])
-        ts = datetime.now().strftime("%H:%M:%S")
-        logs.append(f"{ts} | {msg}")
+        _append_log("tagging_logs", msg)
 
     def log_semantic(msg: str):
-        logs = st.session_state.setdefault("semantic_logs", [])
-        ts = datetime.now().strftime("%H:%M:%S")
-        logs.append(f"{ts} | {msg}")
+        _append_log("semantic_logs", msg)
 
     def log_agent(msg: str):
-        logs = st.session_state.setdefault("agent_logs", [])
-        ts = datetime.now().strftime("%H:%M:%S")
-        logs.append(f"{ts} | {msg}")
+        _append_log("agent_logs", msg)
 
     st.header("Exports")
     if "tagged_pii" in st.session_state:
         st.download_button(
             "Download Tagged PII CSV",
-            st.session_state["tagged_pii"].to_csv(index=False),
+            _to_csv_bytes(st.session_state["tagged_pii"]),
             "tagged_pii.csv",
         )
     if "tagged_aml" in st.session_state:
         st.download_button(
             "Download Tagged AML CSV",
-            st.session_state["tagged_aml"].to_csv(index=False),
+            _to_csv_bytes(st.session_state["tagged_aml"]),
             "tagged_aml.csv",
         )
     if "tagged_reg" in st.session_state:
         st.download_button(
             "Download Tagged Regulatory CSV",
-            st.session_state["tagged_reg"].to_csv(index=False),
+            _to_csv_bytes(st.session_state["tagged_reg"]),
             "tagged_regulatory.csv",
         )
 
-    if st.button("Export Master JSON"):
+    @st.cache_data(show_spinner=False)
+    def _master_records_json(
+        pii: pd.DataFrame, aml: pd.DataFrame, reg: pd.DataFrame
+    ) -> bytes:
+        """Serialised tagged records; the export timestamp is added per call."""
         master = {
-            "generated_at": datetime.now().isoformat(),
-            "tagged_pii": st.session_state.get("tagged_pii", pd.DataFrame()).to_dict(
-                "records"
-            ),
-            "tagged_aml": st.session_state.get("tagged_aml", pd.DataFrame()).to_dict(
-                "records"
-            ),
-            "tagged_reg": st.session_state.get("tagged_reg", pd.DataFrame()).to_dict(
-                "records"
-            ),
+            "tagged_pii": pii.to_dict("records"),
+            "tagged_aml": aml.to_dict("records"),
+            "tagged_reg": reg.to_dict("records"),
         }
+        if orjson is not None:
+            return orjson.dumps(
+                master, default=str, option=orjson.OPT_SERIALIZE_NUMPY
+            )
+        return json.dumps(master, default=str).encode()
+
+    def _build_master_json(
+        pii: pd.DataFrame, aml: pd.DataFrame, reg: pd.DataFrame
+    ) -> bytes:
+        # Splice a fresh "generated_at" in front of the cached records object
+        stamp = json.dumps({"generated_at": datetime.now().isoformat()})
+        return stamp[:-1].encode() + b"," + _master_records_json(pii, aml, reg)[1:]
+
+    if st.button("Export Master JSON"):
         st.download_button(
             "Download JSON",
-            json.dumps(master, indent=2),
+            _build_master_json(
+                st.session_state.get("tagged_pii", pd.DataFrame()),
+                st.session_state.get("tagged_aml", pd.DataFrame()),
+                st.session_state.get("tagged_reg", pd.DataFrame()),
+            ),
             "master_export.json",
         )
 
+# ---------------------------------------------------------------------
+# Helper: cached read + tag pipeline (keyed on uploaded file bytes + nonce)
+# ---------------------------------------------------------------------
+def _read_upload_csv(file_bytes: bytes) -> pd.DataFrame:
+    """Parse an uploaded CSV with the Arrow reader, falling back to the C engine."""
+    try:
+        # Arrow parses; columns still come back as numpy / object dtypes,
+        # the same ones the C engine gives the taggers
+        return pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except (ImportError, ValueError):
+        # pyarrow missing or CSV it can't handle (e.g. ragged rows)
+        return pd.read_csv(io.BytesIO(file_bytes))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_and_tag_pii(file_bytes: bytes, nonce: str = "") -> pd.DataFrame:
+    from utils.tagging_functions import tag_pii_messages
+
+    return tag_pii_messages(_read_upload_csv(file_bytes))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_and_tag_aml(file_bytes: bytes, nonce: str = "") -> pd.DataFrame:
+    from utils.tagging_functions import tag_aml_transactions
+
+    return tag_aml_transactions(_read_upload_csv(file_bytes))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _load_and_tag_reg(file_bytes: bytes, nonce: str = "") -> pd.DataFrame:
+    from utils.tagging_functions import tag_regulatory_obligations
+
+    return tag_regulatory_obligations(_read_upload_csv(file_bytes))
+
+
 # ---------------------------------------------------------------------
 # Helper: explode tag columns for charts
 # ---------------------------------------------------------------------
+@st.cache_data(show_spinner=False)
 def _explode_tag_column(df: pd.DataFrame, col: str, out_col: str) -> pd.DataFrame:
     """Turn list / JSON-string tag column into (tag, count) DataFrame."""
     if col not in df.columns:
         return pd.DataFrame()
 
-    series = df[col].dropna()
-
     def to_list(x):
         if isinstance(x, list):
             return x
@@ -176,25 +239,32 @@ def _explode_tag_column(df: pd.DataFrame, col: str, out_col: str) -> pd.DataFram
             s = x.strip()
             if s.startswith("[") and s.endswith("]"):
                 try:
-                    return json.loads(s.replace("'", '"'))
-                except Exception:
+                    # Python-style list strings parse natively (single quotes ok)
+                    return ast.literal_eval(s)
+                except (ValueError, SyntaxError):
                     return [s]
             return [s]
         return [str(x)]
 
-    tags = []
-    for v in series:
-        for t in to_list(v):
-            t_clean = str(t).strip().strip("'").strip('"')
-            if t_clean:
-                tags.append(t_clean)
+    tags = (
+        df[col]
+        .dropna()
+        .map(to_list)
+        .explode()
+        .dropna()
+        .astype(str)
+        .str.strip()
+        .str.strip("'")
+        .str.strip('"')
+    )
+    # Counter avoids building a second Series just to value_count it
+    counts = Counter(tags)
+    counts.pop("", None)
 
-    if not tags:
+    if not counts:
         return pd.DataFrame()
 
-    vc = pd.Series(tags).value_counts().reset_index()
-    vc.columns = [out_col, "count"]
-    return vc
+    return pd.DataFrame(counts.most_common(), columns=[out_col, "count"])
 
 
 def _parse_breakdown_metric(raw) -> dict:
@@ -209,13 +279,474 @@ def _parse_breakdown_metric(raw) -> dict:
         s = raw.strip()
         if s.startswith("{") and s.endswith("}"):
             try:
-                # Handle both proper JSON and Python-style dict strings
-                return json.loads(s.replace("'", '"'))
-            except Exception:
+                # Handles both JSON-style and Python-style dict strings without
+                # rewriting quotes (keeps apostrophes inside labels intact)
+                parsed = ast.literal_eval(s)
+            except (ValueError, SyntaxError):
                 return {}
+            return parsed if isinstance(parsed, dict) else {}
     return {}
 
 
+# ---------------------------------------------------------------------
+# Helper: cached Plotly figures (keyed on the input frame's content hash)
+# ---------------------------------------------------------------------
+# graph_objects + .to_numpy() skips Plotly Express' DataFrame reshaping and the
+# read-only copy Plotly makes of pandas Series inputs. Transitions and bar
+# outlines are disabled so reruns don't pay for animation/stroke work.
+PLOTLY_CONFIG = {"displayModeBar": False, "staticPlot": False, "responsive": True}
+
+
+@st.cache_resource(show_spinner=False)
+def _plotly():
+    """plotly.graph_objects, imported on the first chart render only."""
+    import plotly.graph_objects as go
+
+    return go
+
+
+@st.cache_data(show_spinner=False)
+def _bar_figure(data: pd.DataFrame, x: str, y: str, title: str):
+    go = _plotly()
+    fig = go.Figure(
+        data=[
+            go.Bar(
+                x=data[x].to_numpy(),
+                y=data[y].to_numpy(),
+                marker={"line": {"width": 0}},
+            )
+        ]
+    )
+    fig.update_layout(
+        title=title, xaxis_title=x, yaxis_title=y, transition={"duration": 0}
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def _histogram_figure(data: pd.DataFrame, x: str, nbins: int, title: str):
+    go = _plotly()
+    fig = go.Figure(
+        data=[
+            go.Histogram(
+                x=data[x].to_numpy(), nbinsx=nbins, marker={"line": {"width": 0}}
+            )
+        ]
+    )
+    fig.update_layout(
+        title=title, xaxis_title=x, yaxis_title="count", transition={"duration": 0}
+    )
+    return fig
+
+
+# ---------------------------------------------------------------------
+# Helper: tagging chart fragments (rerun independently of the full script)
+# ---------------------------------------------------------------------
+def _session_counts(key: str, df: pd.DataFrame, col: str) -> pd.Series:
+    """value_counts of df[col], computed once per tagging run (session cache)."""
+    vc = st.session_state.get(key)
+    if vc is None:
+        vc = df[col].value_counts()
+        st.session_state[key] = vc
+    return vc
+
+
+@st.fragment
+def render_pii_charts(df: pd.DataFrame) -> None:
+    # Real charts for PII
+    if "risk_flag" in df.columns:
+        risk_counts = (
+            _session_counts("tagged_pii_risk_vc", df, "risk_flag")
+            .rename_axis("risk_flag")
+            .reset_index(name="count")
+        )
+        if not risk_counts.empty:
+            st.markdown("**PII risk distribution**")
+            fig_risk = _bar_figure(
+                risk_counts,
+                x="risk_flag",
+                y="count",
+                title="Count of messages by PII risk flag",
+            )
+            st.plotly_chart(fig_risk, use_container_width=True, config=PLOTLY_CONFIG)
+
+    # PII entity frequency
+    if "pii_entities" in df.columns:
+        tag_counts = _explode_tag_column(df, "pii_entities", "pii_entity")
+        if not tag_counts.empty:
+            st.markdown("**Top PII entities detected**")
+            fig_ent = _bar_figure(
+                tag_counts.head(15),
+                x="pii_entity",
+                y="count",
+                title="PII Entity Frequency",
+            )
+            st.plotly_chart(fig_ent, use_container_width=True, config=PLOTLY_CONFIG)
+
+
+@st.fragment
+def render_aml_charts(df: pd.DataFrame) -> None:
+    # AML risk distribution
+    if "risk_score" in df.columns:
+        st.markdown("**Distribution of AML risk scores**")
+        fig_risk = _histogram_figure(
+            df[["risk_score"]],
+            x="risk_score",
+            nbins=10,
+            title="AML Risk Score Distribution",
+        )
+        st.plotly_chart(fig_risk, use_container_width=True, config=PLOTLY_CONFIG)
+
+    # AML tag frequencies
+    if "aml_tags" in df.columns:
+        tag_counts = _explode_tag_column(df, "aml_tags", "aml_tag")
+        if not tag_counts.empty:
+            st.markdown("**Top AML typologies**")
+            fig_tags = _bar_figure(
+                tag_counts.head(15),
+                x="aml_tag",
+                y="count",
+                title="AML Tags Frequency",
+            )
+            st.plotly_chart(fig_tags, use_container_width=True, config=PLOTLY_CONFIG)
+
+
+@st.fragment
+def render_reg_charts(df: pd.DataFrame) -> None:
+    # Owner distribution
+    if "owner" in df.columns:
+        owner_counts = (
+            _session_counts("tagged_reg_owner_vc", df, "owner")
+            .rename_axis("owner")
+            .reset_index(name="count")
+        )
+        st.markdown("**Obligations by owner**")
+        fig_owner = _bar_figure(
+            owner_counts,
+            x="owner",
+            y="count",
+            title="Regulatory Obligations by Owner",
+        )
+        st.plotly_chart(fig_owner, use_container_width=True, config=PLOTLY_CONFIG)
+
+    # Source document distribution
+    if "source_document" in df.columns:
+        src_counts = (
+            _session_counts("tagged_reg_doc_vc", df, "source_document")
+            .rename_axis("source_document")
+            .reset_index(name="count")
+        )
+        st.markdown("**Obligations by document (MAS / HKMA / Basel, etc.)**")
+        fig_src = _bar_figure(
+            src_counts,
+            x="source_document",
+            y="count",
+            title="Regulatory Obligations by Source Document",
+        )
+        st.plotly_chart(fig_src, use_container_width=True, config=PLOTLY_CONFIG)
+
+
+
+
+# ---------------------------------------------------------------------
+# Helper: semantic layer (cached builds keyed on tagged-data hashes)
+# ---------------------------------------------------------------------
+def _current_tagged_data() -> dict:
+    return {
+        "pii": st.session_state.get("tagged_pii", pd.DataFrame()),
+        "aml": st.session_state.get("tagged_aml", pd.DataFrame()),
+        "reg": st.session_state.get("tagged_reg", pd.DataFrame()),
+    }
+
+
+def _frame_hash(name: str) -> str:
+    """Content hash of st.session_state[name], computed once per tagging run."""
+    hash_key = f"{name}_hash"
+    if hash_key not in st.session_state:
+        df = st.session_state.get(name, pd.DataFrame())
+        try:
+            hashed = pd.util.hash_pandas_object(df, index=False)
+        except TypeError:
+            # List-valued tag columns (fresh LLM output) aren't hashable as-is
+            hashed = pd.util.hash_pandas_object(df.astype(str), index=False)
+        st.session_state[hash_key] = hashed.values.tobytes().hex()
+    return st.session_state[hash_key]
+
+
+def _tagged_data_key() -> tuple:
+    return tuple(_frame_hash(n) for n in ("tagged_pii", "tagged_aml", "tagged_reg"))
+
+
+def _metric_rows(metrics: dict, extras=()) -> list:
+    """(metric, value) rows for the key-metrics bar; extras are layer-specific."""
+    keys = [
+        ("aml_high_risk_count", "AML High-Risk Cases"),
+        ("pii_critical_count", "Critical PII Cases"),
+        ("reg_total_paragraphs", "Total Reg Obligations"),
+        *extras,
+    ]
+    return [
+        {"metric": label, "value": metrics[k]} for k, label in keys if k in metrics
+    ]
+
+
+def _add_display_fields(layer: dict, extras=()) -> dict:
+    """Precompute scalar metrics and bar rows once per build, not per rerun."""
+    metrics = layer.get("metrics", {})
+    layer["scalar_metrics"] = {
+        k: v for k, v in metrics.items() if not k.endswith("_breakdown")
+    }
+    layer["metric_rows"] = _metric_rows(metrics, extras)
+    return layer
+
+
+@st.cache_data(show_spinner=False)
+def _cached_core_layer(data_key: tuple, _tagged_data: dict) -> dict:
+    from utils.semantic_layer_builder import build_dbt_core_layer
+
+    return _add_display_fields(build_dbt_core_layer(_tagged_data))
+
+
+def _hybrid_layer(tagged_data: dict) -> dict:
+    """
+    Not st.cache_data: the build's real output (FAISS index, its key) is on
+    disk and must match the current tagged data, and an unchanged corpus
+    already skips re-embedding inside the builder.
+    """
+    from utils.semantic_layer_builder import build_dbt_faiss_hybrid_layer
+
+    return _add_display_fields(
+        build_dbt_faiss_hybrid_layer(tagged_data),
+        extras=[("faiss_size", "FAISS Index Size")],
+    )
+
+
+def _layer_failed(layer: dict) -> bool:
+    return "error" in layer or "failed" in layer.get("status", "")
+
+
+def _build_core_layer() -> dict:
+    """Cached core build; a failed build is evicted so a retry rebuilds."""
+    layer = _cached_core_layer(_tagged_data_key(), _current_tagged_data())
+    if _layer_failed(layer):
+        _cached_core_layer.clear()
+    return layer
+
+
+def _build_hybrid_layer() -> dict:
+    layer = _hybrid_layer(_current_tagged_data())
+    if not _layer_failed(layer):
+        # FAISS index is on disk now; the agent tab checks this before stat()
+        st.session_state["_hybrid_built"] = True
+    return layer
+
+
+@st.cache_data(show_spinner=False)
+def _breakdown_df(raw, label_col: str) -> pd.DataFrame:
+    """Breakdown metric (dict or dict-string) → sorted (label, count) frame."""
+    d = _parse_breakdown_metric(raw)
+    # Breakdown dicts are small: sort in Python (stable on ties) ahead of pandas
+    items = sorted(d.items(), key=lambda kv: kv[1], reverse=True)
+    return pd.DataFrame(items, columns=[label_col, "count"])
+
+
+# (metric key, label column, subplot title) shared by both tabs
+BREAKDOWNS = [
+    ("reg_owner_breakdown", "owner", "Regulatory Obligations by Owner"),
+    (
+        "reg_doc_breakdown",
+        "source_document",
+        "Regulatory Obligations by Source Document",
+    ),
+    ("reg_risk_type_breakdown", "risk_type", "Regulatory Obligations by Risk Type"),
+]
+
+
+@st.cache_data(show_spinner=False)
+def _overview_figure(panels: list, title: str):
+    """One figure, two bar panels per row: panels = [(title, frame, x, y), ...]."""
+    from plotly.subplots import make_subplots
+
+    go = _plotly()
+    rows = (len(panels) + 1) // 2
+    fig = make_subplots(
+        rows=rows, cols=2, subplot_titles=[panel[0] for panel in panels]
+    )
+    for i, (_, data, x, y) in enumerate(panels):
+        fig.add_trace(
+            go.Bar(
+                x=data[x].to_numpy(),
+                y=data[y].to_numpy(),
+                marker={"line": {"width": 0}},
+            ),
+            row=i // 2 + 1,
+            col=i % 2 + 1,
+        )
+    fig.update_layout(
+        title=title,
+        showlegend=False,
+        height=380 * rows,
+        transition={"duration": 0},
+    )
+    return fig
+
+
+def _render_overview(layer: dict, title: str, chart_key: str) -> None:
+    """Key-metrics bar + regulation breakdowns as a single Plotly chart."""
+    metrics = layer.get("metrics", {})
+    panels = []
+    metric_rows = layer.get("metric_rows", [])
+    if metric_rows:
+        panels.append(("Key Metrics", pd.DataFrame(metric_rows), "metric", "value"))
+    for metric_key, label_col, panel_title in BREAKDOWNS:
+        breakdown_df = _breakdown_df(metrics.get(metric_key), label_col)
+        if not breakdown_df.empty:
+            panels.append((panel_title, breakdown_df, label_col, "count"))
+    if not panels:
+        return
+    fig = _overview_figure(panels, title)
+    st.plotly_chart(
+        fig, use_container_width=True, key=chart_key, config=PLOTLY_CONFIG
+    )
+
+
+@st.fragment
+def _render_core_semantic() -> None:
+    """Render the dbt Core layer results without rerunning the whole app."""
+    if "semantic_dbt_core" in st.session_state:
+        layer = st.session_state["semantic_dbt_core"]
+        metrics = layer.get("metrics", {})
+        status = layer.get("status", "")
+
+        st.write(f"**Status:** {status}")
+
+        if metrics:
+            scalar_metrics = layer.get("scalar_metrics", {})
+
+            # Show scalar metrics as a compact, collapsed JSON view
+            if scalar_metrics:
+                st.json(scalar_metrics, expanded=False)
+
+            # KPI cards (AML + PII + total regs); the fragment reuses one slot
+            kpi_slot = st.empty()
+            with kpi_slot.container():
+                col_a, col_b, col_c, col_d = st.columns(4, gap="small")
+                with col_a:
+                    st.metric(
+                        "AML High-Risk Cases",
+                        value=metrics.get("aml_high_risk_count", 0),
+                    )
+                with col_b:
+                    avg_risk = metrics.get("avg_risk_score", 0.0)
+                    st.metric(
+                        "Avg AML Risk Score",
+                        value=f"{avg_risk:.2f}" if avg_risk else "0.00",
+                    )
+                with col_c:
+                    st.metric(
+                        "Critical PII Cases",
+                        value=metrics.get("pii_critical_count", 0),
+                    )
+                with col_d:
+                    st.metric(
+                        "Total Reg Obligations",
+                        value=metrics.get("reg_total_paragraphs", 0),
+                    )
+
+            # Key metrics + regulation breakdowns in one figure
+            _render_overview(
+                layer,
+                "Key Risk & Regulation Metrics (dbt Core Layer)",
+                "core_all",
+            )
+
+
+@st.fragment
+def _render_hybrid_semantic() -> None:
+    """Render the dbt + FAISS hybrid layer results in an isolated rerun scope."""
+    if "semantic_hybrid" in st.session_state:
+        layer = st.session_state["semantic_hybrid"]
+        metrics = layer.get("metrics", {})
+        status = layer.get("status", "")
+
+        st.write(f"**Status:** {status}")
+        if metrics:
+            scalar_metrics = layer.get("scalar_metrics", {})
+
+            if scalar_metrics:
+                st.json(scalar_metrics, expanded=False)
+
+            kpi_slot = st.empty()
+            with kpi_slot.container():
+                col_a, col_b, col_c, col_d, col_e = st.columns(5, gap="small")
+                with col_a:
+                    st.metric(
+                        "AML High-Risk Cases",
+                        value=metrics.get("aml_high_risk_count", 0),
+                    )
+                with col_b:
+                    avg_risk = metrics.get("avg_risk_score", 0.0)
+                    st.metric(
+                        "Avg AML Risk Score",
+                        value=f"{avg_risk:.2f}" if avg_risk else "0.00",
+                    )
+                with col_c:
+                    st.metric(
+                        "Critical PII Cases",
+                        value=metrics.get("pii_critical_count", 0),
+                    )
+                with col_d:
+                    st.metric(
+                        "Total Reg Obligations",
+                        value=metrics.get("reg_total_paragraphs", 0),
+                    )
+                with col_e:
+                    st.metric("FAISS Index Size", metrics.get("faiss_size", 0))
+
+            # Same overview as dbt Core, plus the FAISS index size bar
+            _render_overview(layer, "Key Metrics (Hybrid Layer)", "hybrid_all")
+
+
+# ---------------------------------------------------------------------
+# Helper: per-session agent handles (cleared via the "Reset agents" button)
+# ---------------------------------------------------------------------
+# Kept in st.session_state, not st.cache_resource: each agent carries its
+# conversation memory, which must not be shared across browser sessions
+_AGENT_KEYS = ("_agent_without", "_agent_with_vector")
+
+
+def _session_agent_without():
+    if "_agent_without" not in st.session_state:
+        from utils.agent_builder import create_agent_without_layer_with_trace
+
+        st.session_state["_agent_without"] = create_agent_without_layer_with_trace()
+    return st.session_state["_agent_without"]
+
+
+def _session_agent_with_vector():
+    if "_agent_with_vector" not in st.session_state:
+        from utils.agent_builder import create_agent_with_vector_layer_with_trace
+
+        st.session_state["_agent_with_vector"] = (
+            create_agent_with_vector_layer_with_trace()
+        )
+    return st.session_state["_agent_with_vector"]
+
+
+def _show_preview(preview: list) -> None:
+    """Tool-hit preview records → table, handing Streamlit Arrow directly."""
+    try:
+        # pyarrow ships with streamlit; mixed-type columns fall back to pandas
+        import pyarrow as pa
+
+        data = pa.Table.from_pylist(preview)
+    except Exception:
+        data = pd.DataFrame(preview)
+    try:
+        st.dataframe(data, use_container_width=True)
+    except Exception:
+        st.json(preview)
+
 
 # ---------------------------------------------------------------------
 # Main tabs
@@ -230,6 +761,20 @@ tab_tagging, tab_semantic, tab_agent = st.tabs(
 with tab_tagging:
     st.header("Metadata Tagging")
 
+    # Only the first N rows are shipped to the browser; downloads stay complete
+    preview_n = int(
+        st.number_input(
+            "Rows to preview", min_value=10, value=1000, step=100, key="_preview_n"
+        )
+    )
+
+    def _preview_caption(df: pd.DataFrame) -> None:
+        if len(df) > preview_n:
+            st.caption(
+                f"Showing first {preview_n} of {len(df)} rows – "
+                "use the downloads below for the full table."
+            )
+
     tagging_tab_pii, tagging_tab_aml, tagging_tab_reg = st.tabs(
         [
             "PII & Sensitive Data",
@@ -248,83 +793,63 @@ with tab_tagging:
         ):
             with st.spinner("Tagging PII: NRIC, salary, account numbers..."):
                 log_tagging("Starting PII tagging (PII tab)...")
-                df = pd.read_csv(pii_file)
-                tagged_df = tag_pii_messages(df)
+                # Re-process clicked: a fresh nonce misses the cache for this
+                # call only, leaving other uploads and sessions cached
+                nonce = uuid.uuid4().hex if "tagged_pii" in st.session_state else ""
+                tagged_df = _load_and_tag_pii(pii_file.getvalue(), nonce)
                 st.session_state["tagged_pii"] = tagged_df
+                st.session_state.pop("tagged_pii_hash", None)
                 os.makedirs("outputs", exist_ok=True)
-                tagged_df.to_excel("outputs/tagged_pii.xlsx", index=False)
                 tagged_df.to_csv("outputs/tagged_pii.csv", index=False)
-                risk_counts = (
-                    tagged_df["risk_flag"].value_counts().to_dict()
-                    if "risk_flag" in tagged_df.columns
-                    else {}
-                )
+                risk_counts = {}
+                if "risk_flag" in tagged_df.columns:
+                    risk_vc = tagged_df["risk_flag"].value_counts()
+                    st.session_state["tagged_pii_risk_vc"] = risk_vc
+                    risk_counts = risk_vc.to_dict()
                 log_tagging(
                     f"PII tagging complete → {len(tagged_df)} records, risk={risk_counts}"
                 )
 
         if "tagged_pii" in st.session_state:
-            df = st.session_state["tagged_pii"].copy()
-
-            # Styled dataframe: highlight High/Critical
-            def _style_pii(row):
-                color = ""
-                if str(row.get("risk_flag", "")).lower() in ["high", "critical"]:
-                    color = "background-color: #ffe6e6; font-weight: bold;"
-                return [color] * len(row)
+            df = st.session_state["tagged_pii"]
+
+            # Styled dataframe: highlight High/Critical (one mask for the whole frame)
+            def _style_pii(frame: pd.DataFrame) -> pd.DataFrame:
+                styles = pd.DataFrame("", index=frame.index, columns=frame.columns)
+                if "risk_flag" in frame.columns:
+                    highlight = (
+                        frame["risk_flag"]
+                        .astype(str)
+                        .str.lower()
+                        .isin(["high", "critical"])
+                    )
+                    styles.loc[highlight, :] = (
+                        "background-color: #ffe6e6; font-weight: bold;"
+                    )
+                return styles
 
-            styled = df.style.apply(_style_pii, axis=1)
+            styled = df.head(preview_n).style.apply(_style_pii, axis=None)
             st.dataframe(styled, use_container_width=True, height=450)
+            _preview_caption(df)
 
             # Downloads
             col1, col2 = st.columns(2)
             with col1:
-                if os.path.exists("outputs/tagged_pii.xlsx"):
-                    st.download_button(
-                        "Download PII Excel",
-                        open("outputs/tagged_pii.xlsx", "rb").read(),
-                        "tagged_pii.xlsx",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
+                st.download_button(
+                    "Download PII Excel",
+                    _to_xlsx_bytes(df),
+                    "tagged_pii.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
             with col2:
-                if os.path.exists("outputs/tagged_pii.csv"):
-                    st.download_button(
-                        "Download PII CSV",
-                        open("outputs/tagged_pii.csv", "rb").read(),
-                        "tagged_pii.csv",
-                        "text/csv",
-                    )
-
-            # Real charts for PII
-            if "risk_flag" in df.columns:
-                risk_counts = (
-                    df["risk_flag"].value_counts().reset_index()
-                    if not df["risk_flag"].isna().all()
-                    else pd.DataFrame()
+                st.download_button(
+                    "Download PII CSV",
+                    _to_csv_bytes(df),
+                    "tagged_pii.csv",
+                    "text/csv",
                 )
-                if not risk_counts.empty:
-                    risk_counts.columns = ["risk_flag", "count"]
-                    st.markdown("**PII risk distribution**")
-                    fig_risk = px.bar(
-                        risk_counts,
-                        x="risk_flag",
-                        y="count",
-                        title="Count of messages by PII risk flag",
-                    )
-                    st.plotly_chart(fig_risk, use_container_width=True)
-
-            # PII entity frequency
-            if "pii_entities" in df.columns:
-                tag_counts = _explode_tag_column(df, "pii_entities", "pii_entity")
-                if not tag_counts.empty:
-                    st.markdown("**Top PII entities detected**")
-                    fig_ent = px.bar(
-                        tag_counts.head(15),
-                        x="pii_entity",
-                        y="count",
-                        title="PII Entity Frequency",
-                    )
-                    st.plotly_chart(fig_ent, use_container_width=True)
+
+            render_pii_charts(df)
 
     # ---------------------- AML Risk Tagging -------------------------
     with tagging_tab_aml:
@@ -336,11 +861,13 @@ with tab_tagging:
         ):
             with st.spinner("Tagging AML: structuring, crypto, layering..."):
                 log_tagging("Starting AML tagging (AML tab)...")
-                df = pd.read_csv(aml_file)
-                tagged_df = tag_aml_transactions(df)
+                # Re-process clicked: a fresh nonce misses the cache for this
+                # call only, leaving other uploads and sessions cached
+                nonce = uuid.uuid4().hex if "tagged_aml" in st.session_state else ""
+                tagged_df = _load_and_tag_aml(aml_file.getvalue(), nonce)
                 st.session_state["tagged_aml"] = tagged_df
+                st.session_state.pop("tagged_aml_hash", None)
                 os.makedirs("outputs", exist_ok=True)
-                tagged_df.to_excel("outputs/tagged_aml.xlsx", index=False)
                 tagged_df.to_csv("outputs/tagged_aml.csv", index=False)
                 high_risk = 0
                 if "risk_score" in tagged_df.columns:
@@ -350,50 +877,27 @@ with tab_tagging:
                 )
 
         if "tagged_aml" in st.session_state:
-            df = st.session_state["tagged_aml"].copy()
-            st.dataframe(df, use_container_width=True, height=450)
+            df = st.session_state["tagged_aml"]
+            st.dataframe(df.head(preview_n), use_container_width=True, height=450)
+            _preview_caption(df)
 
             col1, col2 = st.columns(2)
             with col1:
-                if os.path.exists("outputs/tagged_aml.xlsx"):
-                    st.download_button(
-                        "Download AML Excel",
-                        open("outputs/tagged_aml.xlsx", "rb").read(),
-                        "tagged_aml.xlsx",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
+                st.download_button(
+                    "Download AML Excel",
+                    _to_xlsx_bytes(df),
+                    "tagged_aml.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
             with col2:
-                if os.path.exists("outputs/tagged_aml.csv"):
-                    st.download_button(
-                        "Download AML CSV",
-                        open("outputs/tagged_aml.csv", "rb").read(),
-                        "tagged_aml.csv",
-                        "text/csv",
-                    )
-
-            # AML risk distribution
-            if "risk_score" in df.columns:
-                st.markdown("**Distribution of AML risk scores**")
-                fig_risk = px.histogram(
-                    df,
-                    x="risk_score",
-                    nbins=10,
-                    title="AML Risk Score Distribution",
+                st.download_button(
+                    "Download AML CSV",
+                    _to_csv_bytes(df),
+                    "tagged_aml.csv",
+                    "text/csv",
                 )
-                st.plotly_chart(fig_risk, use_container_width=True)
-
-            # AML tag frequencies
-            if "aml_tags" in df.columns:
-                tag_counts = _explode_tag_column(df, "aml_tags", "aml_tag")
-                if not tag_counts.empty:
-                    st.markdown("**Top AML typologies**")
-                    fig_tags = px.bar(
-                        tag_counts.head(15),
-                        x="aml_tag",
-                        y="count",
-                        title="AML Tags Frequency",
-                    )
-                    st.plotly_chart(fig_tags, use_container_width=True)
+
+            render_aml_charts(df)
 
     # ---------------------- Regulatory Obligations -------------------
     with tagging_tab_reg:
@@ -405,72 +909,53 @@ with tab_tagging:
         ):
             with st.spinner("Tagging regulatory paragraphs..."):
                 log_tagging("Starting Regulatory tagging (Reg tab)...")
-                df = pd.read_csv(reg_file)
-                tagged_df = tag_regulatory_obligations(df)
+                # Re-process clicked: a fresh nonce misses the cache for this
+                # call only, leaving other uploads and sessions cached
+                nonce = uuid.uuid4().hex if "tagged_reg" in st.session_state else ""
+                tagged_df = _load_and_tag_reg(reg_file.getvalue(), nonce)
                 st.session_state["tagged_reg"] = tagged_df
+                st.session_state.pop("tagged_reg_hash", None)
                 os.makedirs("outputs", exist_ok=True)
-                tagged_df.to_excel("outputs/tagged_regulatory.xlsx", index=False)
                 tagged_df.to_csv("outputs/tagged_regulatory.csv", index=False)
-                owners = (
-                    tagged_df["owner"].value_counts().to_dict()
-                    if "owner" in tagged_df.columns
-                    else {}
-                )
+                owners = {}
+                if "owner" in tagged_df.columns:
+                    owner_vc = tagged_df["owner"].value_counts()
+                    st.session_state["tagged_reg_owner_vc"] = owner_vc
+                    owners = owner_vc.to_dict()
+                if "source_document" in tagged_df.columns:
+                    st.session_state["tagged_reg_doc_vc"] = (
+                        tagged_df["source_document"].value_counts()
+                    )
                 log_tagging(
                     f"Regulatory tagging complete → {len(tagged_df)} paragraphs, owners={owners}"
                 )
 
         if "tagged_reg" in st.session_state:
-            df = st.session_state["tagged_reg"].copy()
-            st.dataframe(df, use_container_width=True, height=450)
+            df = st.session_state["tagged_reg"]
+            st.dataframe(df.head(preview_n), use_container_width=True, height=450)
+            _preview_caption(df)
 
             col1, col2 = st.columns(2)
             with col1:
-                if os.path.exists("outputs/tagged_regulatory.xlsx"):
-                    st.download_button(
-                        "Download Regulatory Excel",
-                        open("outputs/tagged_regulatory.xlsx", "rb").read(),
-                        "tagged_regulatory.xlsx",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
-            with col2:
-                if os.path.exists("outputs/tagged_regulatory.csv"):
-                    st.download_button(
-                        "Download Regulatory CSV",
-                        open("outputs/tagged_regulatory.csv", "rb").read(),
-                        "tagged_regulatory.csv",
-                        "text/csv",
-                    )
-
-            # Owner distribution
-            if "owner" in df.columns:
-                owner_counts = df["owner"].value_counts().reset_index()
-                owner_counts.columns = ["owner", "count"]
-                st.markdown("**Obligations by owner**")
-                fig_owner = px.bar(
-                    owner_counts,
-                    x="owner",
-                    y="count",
-                    title="Regulatory Obligations by Owner",
+                st.download_button(
+                    "Download Regulatory Excel",
+                    _to_xlsx_bytes(df),
+                    "tagged_regulatory.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 )
-                st.plotly_chart(fig_owner, use_container_width=True)
-
-            # Source document distribution
-            if "source_document" in df.columns:
-                src_counts = df["source_document"].value_counts().reset_index()
-                src_counts.columns = ["source_document", "count"]
-                st.markdown("**Obligations by document (MAS / HKMA / Basel, etc.)**")
-                fig_src = px.bar(
-                    src_counts,
-                    x="source_document",
-                    y="count",
-                    title="Regulatory Obligations by Source Document",
+            with col2:
+                st.download_button(
+                    "Download Regulatory CSV",
+                    _to_csv_bytes(df),
+                    "tagged_regulatory.csv",
+                    "text/csv",
                 )
-                st.plotly_chart(fig_src, use_container_width=True)
+
+            render_reg_charts(df)
 
     # Tagging logs
     with st.expander("Tagging Logs"):
-        logs = st.session_state.get("tagging_logs", [])
+        logs = st.session_state["tagging_logs"]
         if logs:
             st.text("\n".join(logs))
         else:
@@ -497,170 +982,13 @@ with tab_semantic:
         st.subheader("dbt Core Semantic Layer")
         if st.button("Build dbt Core Layer"):
             with st.spinner("Building dbt Core semantic layer..."):
-                tagged_data = {
-                    "pii": st.session_state.get("tagged_pii", pd.DataFrame()),
-                    "aml": st.session_state.get("tagged_aml", pd.DataFrame()),
-                    "reg": st.session_state.get("tagged_reg", pd.DataFrame()),
-                }
                 log_semantic("Running dbt Core layer build...")
-                layer = build_dbt_core_layer(tagged_data)
+                layer = _build_core_layer()
                 st.session_state["semantic_dbt_core"] = layer
                 log_semantic(f"dbt Core layer built with metrics: {layer.get('metrics', {})}")
             st.success("dbt Core layer built.")
 
-        if "semantic_dbt_core" in st.session_state:
-            layer = st.session_state["semantic_dbt_core"]
-            metrics = layer.get("metrics", {})
-            status = layer.get("status", "")
-
-            st.write(f"**Status:** {status}")
-
-            if metrics:
-                # --------- Split scalar vs breakdown metrics ---------
-                scalar_metrics = {
-                    k: v
-                    for k, v in metrics.items()
-                    if not k.endswith("_breakdown")
-                }
-
-                # Show scalar metrics as a normal table
-                if scalar_metrics:
-                    st.dataframe(
-                        pd.DataFrame([scalar_metrics]),
-                        use_container_width=True,
-                    )
-
-                # KPI cards (AML + PII + total regs)
-                col_a, col_b, col_c, col_d = st.columns(4)
-                with col_a:
-                    st.metric(
-                        "AML High-Risk Cases",
-                        value=metrics.get("aml_high_risk_count", 0),
-                    )
-                with col_b:
-                    avg_risk = metrics.get("avg_risk_score", 0.0)
-                    st.metric(
-                        "Avg AML Risk Score",
-                        value=f"{avg_risk:.2f}" if avg_risk else "0.00",
-                    )
-                with col_c:
-                    st.metric(
-                        "Critical PII Cases",
-                        value=metrics.get("pii_critical_count", 0),
-                    )
-                with col_d:
-                    st.metric(
-                        "Total Reg Obligations",
-                        value=metrics.get("reg_total_paragraphs", 0),
-                    )
-
-                # Simple bar for core AML/PII/reg scalar metrics
-                metric_rows = []
-                if "aml_high_risk_count" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "AML High-Risk Cases",
-                            "value": metrics["aml_high_risk_count"],
-                        }
-                    )
-                if "pii_critical_count" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "Critical PII Cases",
-                            "value": metrics["pii_critical_count"],
-                        }
-                    )
-                if "reg_total_paragraphs" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "Total Reg Obligations",
-                            "value": metrics["reg_total_paragraphs"],
-                        }
-                    )
-
-                if metric_rows:
-                    metric_df = pd.DataFrame(metric_rows)
-                    fig_bar = px.bar(
-                        metric_df,
-                        x="metric",
-                        y="value",
-                        title="Key Risk & Regulation Metrics (dbt Core Layer)",
-                    )
-                    st.plotly_chart(
-                        fig_bar,
-                        use_container_width=True,
-                        key="core_metric_bar",
-                    )
-
-                # --------- Regulation breakdown charts ---------
-                st.markdown("### Regulation Breakdown (dbt Core)")
-
-                # 1) Owner breakdown
-                owner_raw = metrics.get("reg_owner_breakdown")
-                owner_dict = _parse_breakdown_metric(owner_raw)
-                if owner_dict:
-                    owner_df = (
-                        pd.DataFrame(
-                            list(owner_dict.items()), columns=["owner", "count"]
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_owner = px.bar(
-                        owner_df,
-                        x="owner",
-                        y="count",
-                        title="Regulatory Obligations by Owner",
-                    )
-                    st.plotly_chart(
-                        fig_owner,
-                        use_container_width=True,
-                        key="core_reg_owner",
-                    )
-
-                # 2) Document breakdown
-                doc_raw = metrics.get("reg_doc_breakdown")
-                doc_dict = _parse_breakdown_metric(doc_raw)
-                if doc_dict:
-                    doc_df = (
-                        pd.DataFrame(
-                            list(doc_dict.items()),
-                            columns=["source_document", "count"],
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_doc = px.bar(
-                        doc_df,
-                        x="source_document",
-                        y="count",
-                        title="Regulatory Obligations by Source Document",
-                    )
-                    st.plotly_chart(
-                        fig_doc,
-                        use_container_width=True,
-                        key="core_reg_doc",
-                    )
-
-                # 3) Risk-type breakdown
-                risk_raw = metrics.get("reg_risk_type_breakdown")
-                risk_dict = _parse_breakdown_metric(risk_raw)
-                if risk_dict:
-                    risk_df = (
-                        pd.DataFrame(
-                            list(risk_dict.items()), columns=["risk_type", "count"]
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_risk = px.bar(
-                        risk_df,
-                        x="risk_type",
-                        y="count",
-                        title="Regulatory Obligations by Risk Type",
-                    )
-                    st.plotly_chart(
-                        fig_risk,
-                        use_container_width=True,
-                        key="core_reg_risk",
-                    )
+        _render_core_semantic()
 
 
     # ---------------------- dbt + FAISS ----------------------------
@@ -669,178 +997,19 @@ with tab_semantic:
         st.subheader("dbt + FAISS (Hybrid Semantic Layer)")
         if st.button("Build Hybrid Layer"):
             with st.spinner("Building dbt + FAISS hybrid semantic layer..."):
-                tagged_data = {
-                    "pii": st.session_state.get("tagged_pii", pd.DataFrame()),
-                    "aml": st.session_state.get("tagged_aml", pd.DataFrame()),
-                    "reg": st.session_state.get("tagged_reg", pd.DataFrame()),
-                }
                 log_semantic("Running dbt + FAISS hybrid layer build...")
-                layer = build_dbt_faiss_hybrid_layer(tagged_data)
+                layer = _build_hybrid_layer()
                 st.session_state["semantic_hybrid"] = layer
                 log_semantic(
                     f"Hybrid layer built with metrics: {layer.get('metrics', {})}"
                 )
             st.success("Hybrid semantic layer built.")
 
-        if "semantic_hybrid" in st.session_state:
-            layer = st.session_state["semantic_hybrid"]
-            metrics = layer.get("metrics", {})
-            status = layer.get("status", "")
-
-            st.write(f"**Status:** {status}")
-            if metrics:
-                # --------- Split scalar vs breakdown metrics ---------
-                scalar_metrics = {
-                    k: v
-                    for k, v in metrics.items()
-                    if not k.endswith("_breakdown")
-                }
-
-                if scalar_metrics:
-                    st.dataframe(
-                        pd.DataFrame([scalar_metrics]),
-                        use_container_width=True,
-                    )
-
-                col_a, col_b, col_c, col_d, col_e = st.columns(5)
-                with col_a:
-                    st.metric(
-                        "AML High-Risk Cases",
-                        value=metrics.get("aml_high_risk_count", 0),
-                    )
-                with col_b:
-                    avg_risk = metrics.get("avg_risk_score", 0.0)
-                    st.metric(
-                        "Avg AML Risk Score",
-                        value=f"{avg_risk:.2f}" if avg_risk else "0.00",
-                    )
-                with col_c:
-                    st.metric(
-                        "Critical PII Cases",
-                        value=metrics.get("pii_critical_count", 0),
-                    )
-                with col_d:
-                    st.metric(
-                        "Total Reg Obligations",
-                        value=metrics.get("reg_total_paragraphs", 0),
-                    )
-                with col_e:
-                    st.metric("FAISS Index Size", metrics.get("faiss_size", 0))
-
-                metric_rows = []
-                if "aml_high_risk_count" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "AML High-Risk Cases",
-                            "value": metrics["aml_high_risk_count"],
-                        }
-                    )
-                if "pii_critical_count" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "Critical PII Cases",
-                            "value": metrics["pii_critical_count"],
-                        }
-                    )
-                if "reg_total_paragraphs" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "Total Reg Obligations",
-                            "value": metrics["reg_total_paragraphs"],
-                        }
-                    )
-                if "faiss_size" in metrics:
-                    metric_rows.append(
-                        {
-                            "metric": "FAISS Index Size",
-                            "value": metrics["faiss_size"],
-                        }
-                    )
-
-                if metric_rows:
-                    metric_df = pd.DataFrame(metric_rows)
-                    fig_bar = px.bar(
-                        metric_df,
-                        x="metric",
-                        y="value",
-                        title="Key Metrics (Hybrid Layer)",
-                    )
-                    st.plotly_chart(
-                        fig_bar,
-                        use_container_width=True,
-                        key="hybrid_metric_bar",
-                    )
-
-                # --------- Regulation breakdown charts (same as dbt core) ---------
-                st.markdown("### Regulation Breakdown (Hybrid Layer)")
-
-                owner_raw = metrics.get("reg_owner_breakdown")
-                owner_dict = _parse_breakdown_metric(owner_raw)
-                if owner_dict:
-                    owner_df = (
-                        pd.DataFrame(
-                            list(owner_dict.items()), columns=["owner", "count"]
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_owner = px.bar(
-                        owner_df,
-                        x="owner",
-                        y="count",
-                        title="Regulatory Obligations by Owner",
-                    )
-                    st.plotly_chart(
-                        fig_owner,
-                        use_container_width=True,
-                        key="hybrid_reg_owner",
-                    )
-
-                doc_raw = metrics.get("reg_doc_breakdown")
-                doc_dict = _parse_breakdown_metric(doc_raw)
-                if doc_dict:
-                    doc_df = (
-                        pd.DataFrame(
-                            list(doc_dict.items()),
-                            columns=["source_document", "count"],
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_doc = px.bar(
-                        doc_df,
-                        x="source_document",
-                        y="count",
-                        title="Regulatory Obligations by Source Document",
-                    )
-                    st.plotly_chart(
-                        fig_doc,
-                        use_container_width=True,
-                        key="hybrid_reg_doc",
-                    )
-
-                risk_raw = metrics.get("reg_risk_type_breakdown")
-                risk_dict = _parse_breakdown_metric(risk_raw)
-                if risk_dict:
-                    risk_df = (
-                        pd.DataFrame(
-                            list(risk_dict.items()), columns=["risk_type", "count"]
-                        )
-                        .sort_values("count", ascending=False)
-                    )
-                    fig_risk = px.bar(
-                        risk_df,
-                        x="risk_type",
-                        y="count",
-                        title="Regulatory Obligations by Risk Type",
-                    )
-                    st.plotly_chart(
-                        fig_risk,
-                        use_container_width=True,
-                        key="hybrid_reg_risk",
-                    )
+        _render_hybrid_semantic()
 
 
     with st.expander("Semantic Layer Build Logs"):
-        logs = st.session_state.get("semantic_logs", [])
+        logs = st.session_state["semantic_logs"]
         if logs:
             st.text("\n".join(logs))
         else:
@@ -862,6 +1031,12 @@ with tab_agent:
         "Ask a question (e.g. NRIC leaks, salary details, high-risk crypto, MAS 610, SAR for T028)"
     )
 
+    if st.button("Reset agents"):
+        # Only this session's agents; other users keep their memory
+        for key in _AGENT_KEYS:
+            st.session_state.pop(key, None)
+        log_agent("Agents reset (conversation memory cleared).")
+
     st.markdown("---")
 
     col1, col2 = st.columns(2)
@@ -877,30 +1052,33 @@ with tab_agent:
                 st.warning("Please enter a query first.")
             else:
                 with st.spinner("Running baseline agent (without semantic layer)..."):
-                    agent_without = create_agent_without_layer_with_trace()
+                    agent_without = _session_agent_without()
                     trace_without = agent_without(query)
+                    # Convert newlines to <br> once so bullets render nicely
+                    # inside the HTML card without rescanning on every rerun
+                    trace_without["answer_html"] = (
+                        trace_without.get("answer", "") or ""
+                    ).replace("\n", "<br>")
+                    trace_without["no_hit"] = (
+                        trace_without.get("hit_count", 0) == 0
+                        or "No results found" in (trace_without.get("answer") or "")
+                    )
                     st.session_state["trace_without"] = trace_without
                     st.session_state["response_without"] = trace_without["answer"]
 
                     # Agent log
-                    no_hit = (
-                        trace_without.get("hit_count", 0) == 0
-                        or "No results found" in (trace_without.get("answer") or "")
-                    )
                     log_agent(
                         f"mode={trace_without.get('mode')} | "
                         f"intent={trace_without.get('intent')} | "
                         f"tool={trace_without.get('tool_name')} | "
                         f"hits={trace_without.get('hit_count')} | "
-                        f"no_results={no_hit} | "
+                        f"no_results={trace_without['no_hit']} | "
                         f"query='{query}'"
                     )
 
         if "trace_without" in st.session_state:
             tw = st.session_state["trace_without"]
-            answer_raw = tw.get("answer", "") or ""
-            # Convert newlines to <br> so bullets render nicely inside the HTML card
-            answer_html = answer_raw.replace("\n", "<br>")
+            answer_html = tw.get("answer_html", "")
 
             with st.container():
                 st.markdown(
@@ -917,10 +1095,7 @@ with tab_agent:
                 preview = tw.get("preview") or []
                 if preview:
                     st.write("**Preview of tool hits (first few rows):**")
-                    try:
-                        st.dataframe(pd.DataFrame(preview), use_container_width=True)
-                    except Exception:
-                        st.json(preview)
+                    _show_preview(preview)
                 else:
                     st.write("No hits to preview (tool returned empty result set).")
 
@@ -936,49 +1111,43 @@ with tab_agent:
                 st.warning("Please enter a query first.")
             else:
                 with st.spinner("Running semantic-layer agent..."):
-
                     # --- Always use the best agent (Hybrid) and auto-build FAISS if needed ---
                     index_path = "outputs/faiss_index.index"
-                    if not os.path.exists(index_path):
-                        tagged_data = {
-                            "pii": st.session_state.get(
-                                "tagged_pii", pd.DataFrame()
-                            ),
-                            "aml": st.session_state.get(
-                                "tagged_aml", pd.DataFrame()
-                            ),
-                            "reg": st.session_state.get(
-                                "tagged_reg", pd.DataFrame()
-                            ),
-                        }
+                    if not st.session_state.get(
+                        "_hybrid_built"
+                    ) and not os.path.exists(index_path):
                         log_semantic(
                             "Auto-building Hybrid Layer before agent run..."
                         )
-                        _ = build_dbt_faiss_hybrid_layer(tagged_data)
+                        _ = _build_hybrid_layer()
 
-                    agent_with = create_agent_with_vector_layer_with_trace()
+                    agent_with = _session_agent_with_vector()
 
                     trace_with = agent_with(query)
-                    st.session_state["trace_with"] = trace_with
-                    st.session_state["response_with"] = trace_with["answer"]
-
-                    no_hit = (
+                    # Convert newlines to <br> once so bullets render nicely
+                    # inside the HTML card without rescanning on every rerun
+                    trace_with["answer_html"] = (
+                        trace_with.get("answer", "") or ""
+                    ).replace("\n", "<br>")
+                    trace_with["no_hit"] = (
                         trace_with.get("hit_count", 0) == 0
                         or "No results found" in (trace_with.get("answer") or "")
                     )
+                    st.session_state["trace_with"] = trace_with
+                    st.session_state["response_with"] = trace_with["answer"]
+
                     log_agent(
                         f"mode={trace_with.get('mode')} | "
                         f"intent={trace_with.get('intent')} | "
                         f"tool={trace_with.get('tool_name')} | "
                         f"hits={trace_with.get('hit_count')} | "
-                        f"no_results={no_hit} | "
+                        f"no_results={trace_with['no_hit']} | "
                         f"query='{query}'"
                     )
 
         if "trace_with" in st.session_state:
             tw = st.session_state["trace_with"]
-            answer_raw = tw.get("answer", "") or ""
-            answer_html = answer_raw.replace("\n", "<br>")
+            answer_html = tw.get("answer_html", "")
 
             with st.container():
                 st.markdown(
@@ -996,10 +1165,7 @@ with tab_agent:
                 preview = tw.get("preview") or []
                 if preview:
                     st.write("**Preview of tool hits (first few rows):**")
-                    try:
-                        st.dataframe(pd.DataFrame(preview), use_container_width=True)
-                    except Exception:
-                        st.json(preview)
+                    _show_preview(preview)
                 else:
                     st.write("No hits to preview (tool returned empty result set).")
 
@@ -1018,7 +1184,7 @@ with tab_agent:
             st.metric("Answer Length", f"{len(resp)} chars")
             st.metric("Hit Count", tw_out.get("hit_count", 0))
             st.write(f"**Intent:** {tw_out.get('intent')} | **Tool:** {tw_out.get('tool_name')}")
-            if tw_out.get("hit_count", 0) == 0 or "No results found" in resp:
+            if tw_out.get("no_hit"):
                 st.write("Result: No hits – raw data struggled.")
             else:
                 st.write("Result: Answer produced directly from raw tools.")
@@ -1029,13 +1195,13 @@ with tab_agent:
             st.metric("Answer Length", f"{len(resp)} chars")
             st.metric("Hit Count", tw_with.get("hit_count", 0))
             st.write(f"**Intent:** {tw_with.get('intent')} | **Tool:** {tw_with.get('tool_name')}")
-            if tw_with.get("hit_count", 0) == 0 or "No results found" in resp:
+            if tw_with.get("no_hit"):
                 st.write("Result: No hits – even semantic layer found nothing.")
             else:
                 st.write("Result: Grounded answer using tagged metadata / vectors.")
 
     with st.expander("Agent Logs / Execution Trail"):
-        logs = st.session_state.get("agent_logs", [])
+        logs = st.session_state["agent_logs"]
         if logs:
             st.text("\n".join(logs))
         else:
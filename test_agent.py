@@ -1,6 +1,7 @@
 import pandas as pd
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from utils.tagging_functions import tag_pii_messages, tag_aml_transactions, tag_regulatory_obligations
 from utils.semantic_layer_builder import build_dbt_core_layer, build_dbt_faiss_hybrid_layer, build_atscale_layer
@@ -17,29 +18,57 @@ REG_CSV = os.path.join(DATA_DIR, "regulatory_paragraphs_45_rows.csv")
 
 # Step 1: Run Obj1 Tagging (simple, save to outputs for agents)
 print("Running Objective 1: Tagging...")
-try:
-    df_pii = pd.read_csv(PII_CSV)
-    tagged_pii = tag_pii_messages(df_pii)
-    tagged_pii.to_csv("outputs/tagged_pii.csv", index=False)
-    
-    df_aml = pd.read_csv(AML_CSV)
-    tagged_aml = tag_aml_transactions(df_aml)
-    tagged_aml.to_csv("outputs/tagged_aml.csv", index=False)
-    
-    df_reg = pd.read_csv(REG_CSV)
-    tagged_reg = tag_regulatory_obligations(df_reg)
-    tagged_reg.to_csv("outputs/tagged_regulatory.csv", index=False)
+
+
+def _tag(tagger, csv_path, out_path):
+    tagged = tagger(pd.read_csv(csv_path))
+    tagged.to_csv(out_path, index=False)
+    return tagged
+
+
+TAGGED_PII_OUT = "outputs/tagged_pii.csv"
+TAGGED_AML_OUT = "outputs/tagged_aml.csv"
+TAGGED_REG_OUT = "outputs/tagged_regulatory.csv"
+
+# The three inputs are independent and each tagger waits on per-row LLM
+# calls, so tag them concurrently
+tagged = {}
+with ThreadPoolExecutor(max_workers=3) as ex:
+    futures = {
+        "pii": ex.submit(_tag, tag_pii_messages, PII_CSV, TAGGED_PII_OUT),
+        "aml": ex.submit(_tag, tag_aml_transactions, AML_CSV, TAGGED_AML_OUT),
+        "reg": ex.submit(_tag, tag_regulatory_obligations, REG_CSV, TAGGED_REG_OUT),
+    }
+    for name, fut in futures.items():
+        try:
+            tagged[name] = fut.result()
+        except Exception as e:
+            print(f"Error in tagging ({name}): {e}")
+if len(tagged) == len(futures):
     print("Tagging complete.")
-except Exception as e:
-    print(f"Error in tagging: {e}")
-    exit(1)
+
+# None for any input whose tagging failed; step 2 then reads its CSV instead
+tagged_pii, tagged_aml, tagged_reg = (tagged.get(n) for n in ("pii", "aml", "reg"))
  
 # Step 2: Run Obj2 Semantic Layer Builds (test all methods, print results)
 print("\nRunning Objective 2: Semantic Layer Builds...")
+
+
+def _tagged_or_csv(frame, path):
+    """Step 1's frame when tagging succeeded, else the last tagged CSV (if any)."""
+    if frame is not None:
+        return frame
+    if os.path.exists(path):
+        return pd.read_csv(path)
+    print(f"Skipping {path}: not tagged in step 1 and no previous output.")
+    return pd.DataFrame()
+
+
+# Reuse the frames from step 1 instead of re-parsing the CSVs just written
 tagged_data = {
-    'pii': pd.read_csv("outputs/tagged_pii.csv"),
-    'aml': pd.read_csv("outputs/tagged_aml.csv"),
-    'reg': pd.read_csv("outputs/tagged_regulatory.csv")
+    'pii': _tagged_or_csv(tagged_pii, TAGGED_PII_OUT),
+    'aml': _tagged_or_csv(tagged_aml, TAGGED_AML_OUT),
+    'reg': _tagged_or_csv(tagged_reg, TAGGED_REG_OUT)
 }
 try:
     # Method 1: dbt Core
@@ -101,24 +130,28 @@ queries = [
 ]
 
 # Step 4: Test Queries Automatically (pass/fail)
+# Agent calls are I/O-bound on the LLM API, so run them concurrently and
+# report in query order once everything is back.
 print("\nTesting Queries...")
-for q in queries:
+agents = [
+    ("without", "Without Layer", agent_without, "expected_without"),
+    ("with", "With Layer", agent_with, "expected_with"),
+    ("vector", "With Vector Layer", agent_vector, "expected_with"),  # similar to with layer
+]
+tasks = [(q, agent) for q in queries for agent in agents]
+
+
+def run_task(task):
+    q, (_, _, agent, _) = task
+    return agent(q['query'])
+
+
+with ThreadPoolExecutor(max_workers=8) as ex:
+    responses = list(ex.map(run_task, tasks))
+
+for i, q in enumerate(queries):
     print(f"\nQuery: {q['query']}")
-    
-    # Without layer
-    resp_without = agent_without(q['query'])
-    pass_without = q['expected_without'] in resp_without
-    print(f"Without Layer: {resp_without}")
-    print(f"Pass: {pass_without}")
-    
-    # With layer
-    resp_with = agent_with(q['query'])
-    pass_with = q['expected_with'] in resp_with
-    print(f"With Layer: {resp_with}")
-    print(f"Pass: {pass_with}")
-    
-    # With vector (similar to with layer)
-    resp_vector = agent_vector(q['query'])
-    pass_vector = q['expected_with'] in resp_vector
-    print(f"With Vector Layer: {resp_vector}")
-    print(f"Pass: {pass_vector}")
\ No newline at end of file
+    for j, (_, label, _, expected_key) in enumerate(agents):
+        resp = responses[i * len(agents) + j]
+        print(f"{label}: {resp}")
+        print(f"Pass: {q[expected_key] in resp}")
@@ -1,9 +1,11 @@
 import os
+import asyncio
 import pandas as pd
 import numpy as np
 
 from utils.semantic_layer_builder import (
     embed_text_azure_single,
+    embed_text_azure_batch_async,
     build_dbt_faiss_hybrid_layer,
     query_vector_layer,
     safe_load,
@@ -19,14 +21,20 @@ sample_texts = [
     "Incoming transfer from a high-risk jurisdiction",
 ]
 
-vectors = []
+# Rows are written in place into one buffer (sized after the first success)
+out = None
+ok_mask = np.zeros(len(sample_texts), dtype=bool)
 for i, text in enumerate(sample_texts):
     v = embed_text_azure_single(text, idx=i)
-    if v is not None:
-        vectors.append(v)
-
-if vectors:
-    arr = np.vstack(vectors)
+    if v is None:
+        continue
+    if out is None:
+        out = np.empty((len(sample_texts), v.shape[0]), dtype=np.float32)
+    out[i] = v
+    ok_mask[i] = True
+
+if ok_mask.any():
+    arr = out if ok_mask.all() else out[ok_mask]
     print("Embedding shape:", arr.shape)
     print("Example dims:", arr[0][:5])
     print("✅ Azure embedding OK")
@@ -44,11 +52,13 @@ paths = {
     "REG": "outputs/tagged_regulatory.csv",
 }
 
+# Each tagged CSV is parsed once here and reused by the tests below
+frames = {}
 for name, path in paths.items():
     exists = os.path.exists(path)
     print(f"{name} file exists:", exists)
     if exists:
-        df = safe_load(path)
+        df = frames[name] = safe_load(path)
         print(f"{name} shape:", df.shape)
         print(df.head(2))
 
@@ -61,7 +71,7 @@ aml_path = "outputs/tagged_aml.csv"
 if not os.path.exists(aml_path):
     print("❌ AML file missing — cannot test narratives.")
 else:
-    df_aml = safe_load(aml_path)
+    df_aml = frames["AML"]
 
     has_masked = "masked_narrative" in df_aml.columns
     has_original = "original_narrative" in df_aml.columns
@@ -86,21 +96,26 @@ print("===================================================")
 if not os.path.exists(aml_path):
     print("❌ AML missing — cannot embed.")
 else:
-    df_aml = safe_load(aml_path)
+    df_aml = frames["AML"]
     texts = df_aml["masked_narrative"].fillna("").tolist()
 
-    failed = []
-    embedded_vectors = []
-
-    for idx, t in enumerate(texts):
-        v = embed_text_azure_single(t, idx=idx)
-        if v is None:
-            failed.append((idx, t[:80]))
-        else:
-            embedded_vectors.append(v)
+    # Embed each distinct narrative once (order-preserving), then scatter
+    # vectors and failure flags back to every original row
+    codes, uniques = pd.factorize(pd.Series(texts))
+    # Batches fan out concurrently (bounded); rows come back in input order
+    unique_vecs, unique_failed = asyncio.run(
+        embed_text_azure_batch_async(
+            uniques.tolist(), batch_size=16, max_in_flight=16
+        )
+    )
+    arr = unique_vecs[codes]
+    failed_idx = np.flatnonzero(np.isin(codes, unique_failed))
+    failed = [(int(idx), texts[idx][:80]) for idx in failed_idx]
 
     print(f"Total AML narratives: {len(texts)}")
-    print(f"Successful embeddings: {len(embedded_vectors)}")
+    print(f"Distinct narratives embedded: {len(uniques)}")
+    print(f"Embedding matrix shape: {arr.shape}")
+    print(f"Successful embeddings: {len(texts) - len(failed)}")
     print(f"Failed embeddings: {len(failed)}")
 
     if failed:
@@ -114,9 +129,9 @@ print(" TEST 5 — Build FAISS Hybrid Layer")
 print("===================================================")
 
 tagged_data = {
-    "pii": safe_load("outputs/tagged_pii.csv"),
-    "aml": safe_load("outputs/tagged_aml.csv"),
-    "reg": safe_load("outputs/tagged_regulatory.csv"),
+    "pii": frames.get("PII", pd.DataFrame()),
+    "aml": frames.get("AML", pd.DataFrame()),
+    "reg": frames.get("REG", pd.DataFrame()),
 }
 
 layer = build_dbt_faiss_hybrid_layer(tagged_data)
@@ -156,7 +171,7 @@ print("===================================================")
 
 ready = True
 
-if not vectors:
+if not ok_mask.any():
     ready = False
     print("❌ Embedding not working.")
 
@@ -0,0 +1,21 @@
+import random
+
+# ---------------------------------------------------------
+# Shared retry backoff for the Azure OpenAI calls
+# (tagging_functions chat completions, semantic_layer_builder embeddings)
+# ---------------------------------------------------------
+
+
+def retry_delay(e: Exception, attempt: int) -> float:
+    """
+    Seconds before the next attempt: the response's Retry-After header when
+    it has one (429s), else 2**attempt, plus up to 1s of jitter so threads
+    or tasks that failed together don't all retry at the same instant.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        delay = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        delay = float(2**attempt)
+    return delay + random.random()
@@ -0,0 +1,149 @@
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from utils.raw_text_index import build_token_index, match_positions
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # pragma: no cover - pandas-only environments
+    pa = pacsv = None
+
+# ---------------------------------------------------------
+# Shared raw_search_* implementation (one searcher per raw CSV)
+# ---------------------------------------------------------
+
+
+def _read_table(path: str, search_col: str):
+    """
+    (data, texts): the CSV as a pyarrow Table (pandas DataFrame without
+    pyarrow) and the searched column lowercased as a numpy str array, or
+    None when the column is missing. Empty cells search as "".
+
+    Both readers keep every column as a string, so hits carry the cell
+    text as written (no inferred dates or ints) and empty cells come back
+    as None, whichever reader ran.
+    """
+    if pacsv is not None:
+        # Only the first block is read to get the header
+        names = pacsv.open_csv(path).schema.names
+        data = pacsv.read_csv(
+            path,
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in names},
+                strings_can_be_null=True,
+            ),
+        )
+        if search_col not in data.column_names:
+            return data, None
+        col = data[search_col].fill_null("")
+        raw = col.to_numpy(zero_copy_only=False).astype(str)
+    else:
+        data = pd.read_csv(path, dtype=str)
+        if search_col not in data.columns:
+            return data, None
+        raw = data[search_col].fillna("").astype(str).to_numpy(dtype=str)
+    # str.lower semantics, same as the query side
+    return data, np.char.lower(raw)
+
+
+def _take_rows(data, positions: list[int], out_cols: List[str]) -> List[Dict[str, Any]]:
+    """Rows at `positions` as dicts holding exactly `out_cols` (None where absent/empty)."""
+    if pa is not None and isinstance(data, pa.Table):
+        # Arrow straight to Python: nulls come back as None, no pandas hop
+        present = [c for c in out_cols if c in data.column_names]
+        rows = data.select(present).take(pa.array(positions, type=pa.int64())).to_pylist()
+        if len(present) < len(out_cols):
+            rows = [{c: row.get(c) for c in out_cols} for row in rows]
+        return rows
+
+    # Exact output columns in one pass; NaN -> None so results serialise cleanly
+    out = data.take(positions).reindex(columns=out_cols).astype(object)
+    return out.where(out.notna(), None).to_dict("records")
+
+
+def make_raw_searcher(
+    tool: str,
+    label: str,
+    candidates: List[str],
+    search_col: str,
+    out_cols: List[str],
+    result_key: str,
+) -> tuple[Callable[..., Dict[str, Any]], Callable[[], None]]:
+    """
+    Build (search, clear_cache) for one raw CSV.
+
+    search(query, limit) returns
+      {"tool", "query", "approximate": True, result_key: [...], "count"}
+    with one dict per hit holding exactly `out_cols` (None where the CSV
+    lacks a column or a cell is empty), or a "note" when the first existing
+    path in `candidates` is missing `search_col`. The column lists and keys
+    are bound here once instead of being looked up on every call.
+    """
+    out_cols = list(out_cols)
+    note = f"Raw {label} CSV not found or missing '{search_col}' column."
+
+    @lru_cache(maxsize=1)
+    def read(path: str, mtime_ns: int):
+        """
+        Parse the CSV once per file version (pyarrow's multithreaded reader
+        when installed, kept as an Arrow table), plus an inverted token index
+        over the lowercased search column, so a query only substring-checks
+        the rows its tokens can appear in.
+        """
+        data, texts = _read_table(path, search_col)
+        if texts is None:
+            return data, None, None
+        return data, texts, build_token_index(texts)
+
+    @lru_cache(maxsize=512)
+    def cached_rows(path: str, mtime_ns: int, q: str, limit: int):
+        """
+        Output rows for one lowercased query, memoised per file version.
+        Literal, case-insensitive match: token-index candidates, then a
+        substring check on just those rows.
+        """
+        data, texts, index = read(path, mtime_ns)
+        positions = list(match_positions(texts, index, q, limit))
+        return tuple(_take_rows(data, positions, out_cols))
+
+    def clear_cache() -> None:
+        """Drop the parsed CSV and memoised results (e.g. after editing it in place)."""
+        read.cache_clear()
+        cached_rows.cache_clear()
+
+    def search(query: str, limit: int = 20) -> Dict[str, Any]:
+        src = next(
+            (
+                (path, os.stat(path).st_mtime_ns)
+                for path in candidates
+                if os.path.exists(path)
+            ),
+            None,
+        )
+        data, texts, _ = read(*src) if src else (None, None, None)
+        if texts is None or len(data) == 0:
+            return {
+                "tool": tool,
+                "query": query,
+                "approximate": True,
+                result_key: [],
+                "count": 0,
+                "note": note,
+            }
+
+        # Fresh dicts per call: the cached rows are shared between callers
+        rows = [dict(row) for row in cached_rows(*src, query.lower(), limit)]
+        return {
+            "tool": tool,
+            "query": query,
+            "approximate": True,
+            result_key: rows,
+            "count": len(rows),
+        }
+
+    return search, clear_cache
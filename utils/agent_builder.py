@@ -1,8 +1,20 @@
+import ast
 import json
+import os
 import re
+import sys
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Dict, Any, List
 
-from langchain_classic.memory import ConversationBufferMemory
+import pandas as pd
+
+try:
+    import orjson  # optional, faster list-string parsing
+except ImportError:  # pragma: no cover - fallback to stdlib json
+    orjson = None
 
 # Tagged (semantic layer) tools
 from utils.tagging_wrappers import (
@@ -19,17 +31,46 @@ from utils.raw_search_reg import raw_search_reg
 # Semantic / vector layer helpers (for “with layer” demos)
 from utils.semantic_layer_builder import (
     query_semantic_layer,
-    query_vector_layer,
-    query_regulations
+    query_regulations,
+    lookup_aml_transaction,
 )
 
 # ============================================================
 # 1. SIMPLE, FULLY DETERMINISTIC INTENT ROUTER (NO LLM)
 # ============================================================
 
+# Every keyword the router looks at, longest first so "mas 610" wins over
+# "mas" at the same position. The zero-width lookahead lets one finditer
+# pass report overlapping hits ("suspicious transactions" + "transactions").
+_ROUTER_KEYWORDS = sorted(
+    {
+        "nric", "salary", "pii", "chats", "messages",
+        "structuring", "crypto", "high-risk", "high risk", "transactions", "risk",
+        "mas 610", "mas", "610", "suspicious transactions",
+        "sar", "t028",
+    },
+    key=len,
+    reverse=True,
+)
+_ROUTER_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in _ROUTER_KEYWORDS) + "))"
+)
+_TX_RE = re.compile(r"\bT\d+\b", re.IGNORECASE)
+
+# Intent keyword groups, built once so each rule is a single set op
+_PII_KW = frozenset({"nric", "salary", "pii", "chats", "messages"})
+_AML_KW = frozenset({"structuring", "crypto", "high-risk", "high risk"})
+_AML_TX_KW = frozenset({"risk", "crypto"})
+_REG_KW = frozenset({"mas 610", "suspicious transactions"})
+_REG_ALL_KW = frozenset({"mas", "610"})
+_SAR_ALL_KW = frozenset({"sar", "t028"})
+
+
+@lru_cache(maxsize=512)
 def simple_intent_router(query: str) -> str:
     """
     Very small rule-based router for the demo / golden questions.
+    Pure in `query`, so results are memoized across Streamlit reruns.
 
     Returns one of:
       - "PII_SEARCH"
@@ -38,24 +79,28 @@ def simple_intent_router(query: str) -> str:
       - "SAR_DRAFT"
       - "OUT_OF_SCOPE"
     """
-    q = query.lower()
+    # Single scan of the query; the rules below are then set lookups
+    found = {m.group(1) for m in _ROUTER_RE.finditer(query.lower())}
+    # No router keyword at all: out of scope without walking the rules
+    if not found:
+        return "OUT_OF_SCOPE"
 
     # PII-type queries
-    if "nric" in q or "salary" in q or "pii" in q or "chats" in q or "messages" in q:
+    if found & _PII_KW:
         return "PII_SEARCH"
 
     # AML queries
-    if "structuring" in q or "crypto" in q or "high-risk" in q or "high risk" in q:
+    if found & _AML_KW:
         return "AML_SEARCH"
-    if "transactions" in q and ("risk" in q or "crypto" in q):
+    if "transactions" in found and found & _AML_TX_KW:
         return "AML_SEARCH"
 
     # Regulatory queries
-    if "mas 610" in q or ("mas" in q and "610" in q) or "suspicious transactions" in q:
+    if found & _REG_KW or _REG_ALL_KW <= found:
         return "REG_SEARCH"
 
     # SAR draft queries
-    if "sar" in q and "t028" in q:
+    if _SAR_ALL_KW <= found:
         return "SAR_DRAFT"
 
     return "OUT_OF_SCOPE"
@@ -63,8 +108,8 @@ def simple_intent_router(query: str) -> str:
 
 def extract_tx_id(query: str) -> str:
     """Extract a transaction ID like T028 from the query text."""
-    m = re.search(r"\bT\d+\b", query.upper())
-    return m.group(0) if m else ""
+    m = _TX_RE.search(query)
+    return m.group(0).upper() if m else ""
 
 
 # ============================================================
@@ -88,15 +133,10 @@ def _to_list(value: Any) -> List[str]:
 
         # Try JSON-style / Python list-style
         if s.startswith("[") and s.endswith("]"):
-            try:
-                # tolerate single quotes
-                s_json = s.replace("'", '"')
-                arr = json.loads(s_json)
-                if isinstance(arr, list):
-                    return [str(v).strip().strip("'").strip('"') for v in arr if str(v).strip()]
-            except Exception:
-                # fall through to comma split
-                pass
+            arr = _loads_list(s)
+            if arr is not None:
+                return [str(v).strip().strip("'").strip('"') for v in arr if str(v).strip()]
+            # fall through to comma split
 
         # Comma-separated string
         if "," in s:
@@ -110,11 +150,110 @@ def _to_list(value: Any) -> List[str]:
     return [str(value).strip().strip("'").strip('"')]
 
 
+def _loads_list(s: str):
+    """
+    Parse a bracketed list string; None when it isn't a list.
+
+    Tries JSON first, then a Python literal (so "['O'Brien']"-style quoting
+    inside double quotes survives), and only then the old blanket
+    single->double quote swap.
+    """
+    try:
+        arr = orjson.loads(s) if orjson is not None else json.loads(s)
+    except Exception:
+        try:
+            arr = ast.literal_eval(s)
+        except Exception:
+            try:
+                arr = json.loads(s.replace("'", '"'))
+            except Exception:
+                return None
+    return arr if isinstance(arr, list) else None
+
+
+def _to_list_series(values: pd.Series) -> pd.Series:
+    """
+    Column-wise _to_list: same output per cell, but string cells are
+    stripped / split with pandas .str ops in one pass instead of per row.
+    """
+    values = values.reset_index(drop=True)
+    out = pd.Series([[] for _ in range(len(values))], dtype=object)
+
+    is_str = values.map(lambda v: isinstance(v, str)).astype(bool)
+    # Lists / scalars are already structured: reuse the scalar normaliser
+    for i in values.index[~is_str]:
+        out[i] = _to_list(values[i])
+
+    s = values[is_str].astype(object).str.strip()
+    s = s[s != ""]
+    if s.empty:
+        return out
+
+    # "['NRIC', 'account number']" -> list via _loads_list (JSON, then Python literal)
+    bracketed = s.str.startswith("[") & s.str.endswith("]")
+    parsed = s[bracketed].map(_loads_list)
+    parsed = parsed[parsed.notna()]
+    for i, arr in parsed.items():
+        out[i] = [str(v).strip().strip("'").strip('"') for v in arr if str(v).strip()]
+    s = s.drop(parsed.index)
+
+    # "NRIC, account number" -> split + strip, empties dropped
+    has_comma = s.str.contains(",", regex=False)
+    parts = s[has_comma].str.split(",").explode()
+    parts = parts.str.strip().str.strip("'").str.strip('"')
+    parts = parts[parts != ""]
+    for i, labels in parts.groupby(level=0).agg(list).items():
+        out[i] = labels
+    for i in s.index[has_comma].difference(parts.index):
+        out[i] = []
+
+    # Single label
+    single = s[~has_comma].str.strip("'").str.strip('"')
+    for i, label in single.items():
+        out[i] = [label]
+    return out
+
+
 
 # ============================================================
 # 3. WRITER HELPERS (SHARED FORMAT ACROSS ALL MODES)
 # ============================================================
 
+# Field fallbacks per tool row, first truthy value wins
+PII_ID_KEYS = ("message_id", "id")
+PII_RISK_KEYS = ("risk_flag", "risk_level")
+PII_ENTITY_KEYS = ("pii_entities", "entities")
+PII_TEXT_KEYS = ("masked_text", "original_text", "text")
+AML_ID_KEYS = ("transaction_id", "tx_id")
+AML_AMOUNT_KEYS = ("amount_sgd", "amount", "amount_SGD")
+AML_RISK_KEYS = ("risk_score", "risk")
+AML_TAG_KEYS = ("aml_tags", "tags", "typology")
+AML_TEXT_KEYS = ("masked_narrative", "original_narrative", "narrative")
+REG_DOC_KEYS = ("regulation", "source_document")
+REG_TEXT_KEYS = ("paragraph_text", "original_text", "text")
+REG_OWNER_KEYS = ("owner", "business_unit", "assigned_to")
+
+
+def _first(row: Dict[str, Any], keys: tuple, default: Any = None) -> Any:
+    """Equivalent of row.get(k1) or row.get(k2) or ... or default."""
+    for k in keys:
+        v = row.get(k)
+        if v:
+            return v
+    return default
+
+
+def _clip_series(values: List[Any], width: int) -> pd.Series:
+    """
+    Single-line text per value, cut to `width` chars with a trailing '...'.
+    Done column-wise with .str ops instead of slicing inside render loops.
+    """
+    text = pd.Series([str(v) for v in values], dtype=object)
+    text = text.str.replace("\n", " ", regex=False).str.strip()
+    too_long = text.str.len() > width
+    return text.where(~too_long, text.str.slice(0, width - 3).str.rstrip() + "...")
+
+
 def format_pii_results(tool_result: Dict[str, Any]) -> str:
     """
     Format PII tool output in a human-friendly, actionable style.
@@ -139,10 +278,9 @@ def format_pii_results(tool_result: Dict[str, Any]) -> str:
 
     # Risk distribution for summary line
     risk_counts = {"Critical": 0, "High": 0, "Medium": 0, "Low": 0}
-    for h in hits:
-        if not isinstance(h, dict):
-            continue
-        r = str(h.get("risk_flag") or h.get("risk_level") or "").title()
+    dict_hits = [h for h in hits if isinstance(h, dict)]
+    for h in dict_hits:
+        r = str(_first(h, PII_RISK_KEYS, "")).title()
         if r in risk_counts:
             risk_counts[r] += 1
 
@@ -158,30 +296,18 @@ def format_pii_results(tool_result: Dict[str, Any]) -> str:
     )
 
     # Render each hit (limit for readability if you want; here we show all)
-    for h in hits:
-        if not isinstance(h, dict):
-            continue
-
-        msg_id = h.get("message_id") or h.get("id") or "-"
-        risk = h.get("risk_flag") or h.get("risk_level") or "(not provided)"
-
-        entities_raw = h.get("pii_entities") or h.get("entities") or []
-        entities_list = _to_list(entities_raw)
+    # Normalise the whole entities column at once rather than per hit
+    entities_col = _to_list_series(
+        pd.Series([_first(h, PII_ENTITY_KEYS, []) for h in dict_hits], dtype=object)
+    )
+    # Prefer masked_text so you can show safe content
+    excerpts = _clip_series([_first(h, PII_TEXT_KEYS, "") for h in dict_hits], 140)
+    for h, entities_list, excerpt in zip(dict_hits, entities_col, excerpts):
         entities_str = ", ".join(entities_list) if entities_list else "(not provided)"
-
-        # Prefer masked_text so you can show safe content
-        excerpt = (
-            h.get("masked_text")
-            or h.get("original_text")
-            or h.get("text")
-            or ""
-        )
-        excerpt = str(excerpt).replace("\n", " ").strip()
-        if len(excerpt) > 140:
-            excerpt = excerpt[:137].rstrip() + "..."
-
         lines.append(
-            f"\n• ID: `{msg_id}` | Risk: **{risk}** | Entities: {entities_str}"
+            f"\n• ID: `{_first(h, PII_ID_KEYS, '-')}` "
+            f"| Risk: **{_first(h, PII_RISK_KEYS, '(not provided)')}** "
+            f"| Entities: {entities_str}"
         )
         if excerpt:
             lines.append(f"  _Excerpt (masked):_ {excerpt}")
@@ -215,35 +341,20 @@ def format_aml_results(tool_result: Dict[str, Any]) -> str:
     lines.append("**High-Risk Transactions:**")
     lines.append(f"Total: {total} transactions (showing up to first {min(total, 20)}).")
 
-    for m in matches[:20]:
-        if not isinstance(m, dict):
-            continue
-
-        tx_id = m.get("transaction_id") or m.get("tx_id") or "(not provided)"
-        amount = (
-            m.get("amount_sgd")
-            or m.get("amount")
-            or m.get("amount_SGD")
-        )
-        risk = m.get("risk_score") or m.get("risk") or None
+    shown = [m for m in matches[:20] if isinstance(m, dict)]
+    tags_col = _to_list_series(
+        pd.Series([_first(m, AML_TAG_KEYS, []) for m in shown], dtype=object)
+    )
+    narratives = _clip_series([_first(m, AML_TEXT_KEYS, "") for m in shown], 160)
+    for m, tags_list, narrative in zip(shown, tags_col, narratives):
+        tx_id = _first(m, AML_ID_KEYS, "(not provided)")
+        # A falsy amount_SGD (e.g. 0) is still shown, as the old `or` chain did
+        amount = _first(m, AML_AMOUNT_KEYS) or m.get(AML_AMOUNT_KEYS[-1])
+        risk = _first(m, AML_RISK_KEYS)
         risk_str = f"{risk}/10" if risk is not None else "(not provided)"
-
-        tags_raw = m.get("aml_tags") or m.get("tags") or m.get("typology") or []
-        tags_list = _to_list(tags_raw)
         tags_str = ", ".join(tags_list) if tags_list else "(not provided)"
-
         amount_part = f" | SGD {amount}" if amount is not None else ""
 
-        narrative = (
-            m.get("masked_narrative")
-            or m.get("original_narrative")
-            or m.get("narrative")
-            or ""
-        )
-        narrative = str(narrative).replace("\n", " ").strip()
-        if len(narrative) > 160:
-            narrative = narrative[:157].rstrip() + "..."
-
         lines.append(
             f"\n• **{tx_id}**{amount_part} | Risk: **{risk_str}**\n"
             f"  Tags: {tags_str}"
@@ -279,40 +390,16 @@ def format_reg_results(tool_result: Dict[str, Any]) -> str:
     lines.append("**Regulatory Obligations:**")
     lines.append(f"Total: {total} obligations (showing up to first {min(total, 20)}).")
 
-    for m in matches[:20]:
-        if not isinstance(m, dict):
-            continue
-
-        regulation = (
-            m.get("regulation")
-            or m.get("source_document")
-            or ""
-        )
-        regulation = str(regulation).strip()
-        if regulation:
-            prefix = f"[{regulation}] "
-        else:
-            prefix = ""
-
-        text = (
-            m.get("paragraph_text")
-            or m.get("original_text")
-            or m.get("text")
-            or "(not provided)"
-        )
-        text = str(text).replace("\n", " ").strip()
-        if len(text) > 200:
-            text = text[:197].rstrip() + "..."
-
-        owner = (
-            m.get("owner")
-            or m.get("business_unit")
-            or m.get("assigned_to")
-            or "(not provided)"
-        )
+    shown = [m for m in matches[:20] if isinstance(m, dict)]
+    texts = _clip_series(
+        [_first(m, REG_TEXT_KEYS, "(not provided)") for m in shown], 200
+    )
+    for m, text in zip(shown, texts):
+        regulation = str(_first(m, REG_DOC_KEYS, "")).strip()
+        prefix = f"[{regulation}] " if regulation else ""
+        owner = _first(m, REG_OWNER_KEYS, "(not provided)")
 
-        lines.append(f"\n• {prefix}{text}")
-        lines.append(f"  Owner: **{owner}**")
+        lines.append(f"\n• {prefix}{text}\n  Owner: **{owner}**")
 
     return "\n".join(lines)
 
@@ -396,8 +483,9 @@ def _format_reg_metrics_for_answer() -> str:
 
 def sar_draft_from_aml_tool(tx_id: str) -> Dict[str, Any]:
     """
-    Create a very small SAR draft for a given transaction id Txxx
-    by reusing the existing AML tagged search tool.
+    Create a very small SAR draft for a given transaction id Txxx.
+    Exact ids are read from the prebuilt tx_id lookup; otherwise we fall
+    back to the existing AML tagged search tool.
 
     NOTE: We intentionally base SAR on the tagged AML layer,
     because risk_score/typologies live there.
@@ -405,11 +493,15 @@ def sar_draft_from_aml_tool(tx_id: str) -> Dict[str, Any]:
     if not tx_id:
         tx_id = "T028"  # sensible default for demo
 
-    # Ask AML tool to search by transaction id
-    try:
-        aml_result = search_aml_tool({"query": tx_id})
-    except Exception:
-        aml_result = []
+    row = lookup_aml_transaction(tx_id)
+    if row is not None:
+        aml_result = [row]
+    else:
+        # Ask AML tool to search by transaction id
+        try:
+            aml_result = search_aml_tool({"query": tx_id})
+        except Exception:
+            aml_result = []
 
     # Normalize to list of dicts
     matches: List[Dict[str, Any]] = []
@@ -489,7 +581,58 @@ def format_sar_result(sar_result: Dict[str, Any]) -> str:
 # 5. MODE-SPECIFIC TOOL ADAPTERS
 # ============================================================
 
-def _normalize_raw_result(obj: Any, key_candidates: List[str]) -> List[Dict[str, Any]]:
+# Raw-mode PII keyword -> entity label, in reporting order
+_PII_ENTITY_KEYWORDS = (
+    ("nric", "NRIC"),
+    ("passport", "Passport"),
+    ("phone", "Phone"),
+    ("phone number", "Phone Number"),
+    ("account", "Account"),
+    ("account number", "Account Number"),
+    ("salary", "Salary"),
+)
+# Same lookahead trick as the router: one finditer pass over the text,
+# longest keyword first at each position. Case-insensitive so hit text is
+# scanned as-is instead of lower()-copied first.
+_PII_ENTITY_RE = re.compile(
+    "(?=("
+    + "|".join(
+        re.escape(k)
+        for k in sorted((k for k, _ in _PII_ENTITY_KEYWORDS), key=len, reverse=True)
+    )
+    + "))",
+    re.IGNORECASE,
+)
+# A hit on "phone number" is also a hit on "phone", etc.
+_PII_KW_IMPLIES = {
+    k: frozenset(o for o, _ in _PII_ENTITY_KEYWORDS if o in k)
+    for k, _ in _PII_ENTITY_KEYWORDS
+}
+_PII_HIGH_RISK_KW = frozenset({"nric", "passport", "account"})
+# Shared label objects for every converted hit (comparable with `is`)
+_RISK_HIGH, _RISK_MED, _RISK_LOW = map(sys.intern, ("High", "Medium", "Low"))
+
+# Raw-mode AML tags found in a narrative; the group name is the tag label
+_AML_TAG_RE = re.compile(
+    r"(?P<Crypto>crypto)|(?P<Structuring>structuring)", re.IGNORECASE
+)
+_AML_TAG_ORDER = ("Crypto", "Structuring")
+
+
+# Result-list keys tried (in order) when a raw_search_* returns a dict
+_RAW_PII_KEYS = ("hits", "results", "matches", "rows")
+_RAW_MATCH_KEYS = ("matches", "results", "rows")
+
+
+def _dict_rows(rows: list) -> List[Dict[str, Any]]:
+    # raw_search_* normally return clean list[dict]: hand those back as-is
+    # and only build a filtered copy when a stray non-dict shows up
+    if all(type(x) is dict for x in rows):
+        return rows
+    return [x for x in rows if isinstance(x, dict)]
+
+
+def _normalize_raw_result(obj: Any, key_candidates: tuple) -> List[Dict[str, Any]]:
     """
     Helper to normalize raw tool outputs from raw_search_*.
 
@@ -498,11 +641,13 @@ def _normalize_raw_result(obj: Any, key_candidates: List[str]) -> List[Dict[str,
     - Otherwise, return []
     """
     if isinstance(obj, list):
-        return [x for x in obj if isinstance(x, dict)]
+        return _dict_rows(obj)
     if isinstance(obj, dict):
-        for k in key_candidates:
-            if k in obj and isinstance(obj[k], list):
-                return [x for x in obj[k] if isinstance(x, dict)]
+        k = next(
+            (k for k in key_candidates if isinstance(obj.get(k), list)), None
+        )
+        if k is not None:
+            return _dict_rows(obj[k])
     return []
 
 
@@ -514,36 +659,29 @@ def _pii_results_for_mode(query: str, mode: str) -> Dict[str, Any]:
     if mode == "no_layer":
         # Raw path – uses raw_search_pii, then infers approximate entities & risk
         raw = raw_search_pii(query)
-        hits_raw = _normalize_raw_result(raw, ["hits", "results", "matches", "rows"])
+        hits_raw = _normalize_raw_result(raw, _RAW_PII_KEYS)
         q = query.lower()
-
-        keyword_to_entity = {
-            "nric": "NRIC",
-            "passport": "Passport",
-            "phone": "Phone",
-            "phone number": "Phone Number",
-            "account": "Account",
-            "account number": "Account Number",
-            "salary": "Salary",
-        }
+        # No keyword hit -> the query itself is the entity; same for every hit
+        q_fallback = (sys.intern(query),) if q else ()
 
         converted = []
         for h in hits_raw:
-            text = (h.get("text") or h.get("original_text") or "").lower()
-            entities = []
-            for kw, label in keyword_to_entity.items():
-                if kw in text:
-                    entities.append(label)
-            if not entities and q:
-                entities.append(query)
+            text = h.get("text") or h.get("original_text") or ""
+            found = set()
+            for m in _PII_ENTITY_RE.finditer(text):
+                # .get: skips odd Unicode case-folds that lower() never matched
+                found |= _PII_KW_IMPLIES.get(m.group(1).lower(), frozenset())
+            entities = [
+                label for kw, label in _PII_ENTITY_KEYWORDS if kw in found
+            ] or list(q_fallback)
 
             # Crude risk heuristic for demo
-            if any(x in text for x in ["nric", "passport", "account"]):
-                risk = "High"
-            elif "salary" in text:
-                risk = "Medium"
+            if found & _PII_HIGH_RISK_KW:
+                risk = _RISK_HIGH
+            elif "salary" in found:
+                risk = _RISK_MED
             else:
-                risk = "Low"
+                risk = _RISK_LOW
 
             converted.append(
                 {
@@ -573,19 +711,24 @@ def _aml_results_for_mode(query: str, mode: str) -> Dict[str, Any]:
     """
     if mode == "no_layer":
         raw = raw_search_aml(query)
-        matches_raw = _normalize_raw_result(raw, ["matches", "results", "rows"])
+        matches_raw = _normalize_raw_result(raw, _RAW_MATCH_KEYS)
 
         converted = []
         q = query.lower()
+        # Tags implied by the query are the same for every row
+        q_tags = set()
+        if "crypto" in q:
+            q_tags.add("Crypto")
+        if "structuring" in q or "structured" in q:
+            q_tags.add("Structuring")
+        q_fallback = (sys.intern(query),) if q else ()
+
         for m in matches_raw:
-            narrative = (m.get("narrative") or "").lower()
-            tags = []
-            if "crypto" in q or "crypto" in narrative:
-                tags.append("Crypto")
-            if "structuring" in q or "structured" in q or "structuring" in narrative:
-                tags.append("Structuring")
-            if not tags and q:
-                tags.append(query)
+            narrative = m.get("narrative") or ""
+            found = q_tags.union(
+                t.lastgroup for t in _AML_TAG_RE.finditer(narrative)
+            )
+            tags = [t for t in _AML_TAG_ORDER if t in found] or list(q_fallback)
 
             converted.append(
                 {
@@ -616,7 +759,7 @@ def _reg_results_for_mode(query: str, mode: str) -> Dict[str, Any]:
     """
     if mode == "no_layer":
         raw = raw_search_reg(query)
-        matches_raw = _normalize_raw_result(raw, ["matches", "results", "rows"])
+        matches_raw = _normalize_raw_result(raw, _RAW_MATCH_KEYS)
 
         converted = []
         for m in matches_raw:
@@ -645,6 +788,71 @@ def _reg_results_for_mode(query: str, mode: str) -> Dict[str, Any]:
         return {"matches": matches, "count": len(matches)}
     return {"matches": [], "count": 0}
 
+REG_CSV_PATH = os.path.join("outputs", "tagged_regulatory.csv")
+
+# Every phrase _reg_metric_answer keys off, found in one pass over the query
+# (none is a substring of another, so the lookahead reports each hit)
+_REG_METRIC_RE = re.compile(
+    "(?=(mas 610|mas notice 610|suspicious|how many|count|deadline"
+    "|show|list|missing|owner))"
+)
+
+
+def _reg_csv_mtime() -> int:
+    """Cache-busting key: changes whenever the tagged regulatory CSV is rewritten."""
+    try:
+        return os.stat(REG_CSV_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+
+@lru_cache(maxsize=32)
+def _cached_reg_frame(source: str, risk: str, mtime_ns: int) -> pd.DataFrame:
+    """query_regulations() result for one filter, memoized per CSV version."""
+    return query_regulations(
+        {"source_document": source, "risk_type": risk}, as_frame=True
+    )
+
+
+@lru_cache(maxsize=32)
+def _cached_reg_rows(source: str, risk: str, mtime_ns: int) -> tuple:
+    return tuple(_cached_reg_frame(source, risk, mtime_ns).to_dict("records"))
+
+
+def _blank(df: pd.DataFrame, col: str) -> pd.Series:
+    """
+    Column-wise "value not provided": NaN or whitespace-only.
+    A missing column counts as blank.
+    """
+    if col not in df.columns:
+        return pd.Series(True, index=df.index)
+    values = df[col]
+    return values.isna() | values.astype(str).str.strip().eq("")
+
+
+def _or_missing(value: Any) -> Any:
+    """Display helper matching _blank: NaN / blank cells show as '(missing)'."""
+    if isinstance(value, str):
+        return value if value.strip() else "(missing)"
+    return "(missing)" if pd.isna(value) else value
+
+
+@lru_cache(maxsize=32)
+def _reg_deadline_stats(source: str, risk: str, mtime_ns: int) -> tuple:
+    """(total, with_deadline, without_deadline) for the filtered rows."""
+    df = _cached_reg_frame(source, risk, mtime_ns)
+    with_deadline = int((~_blank(df, "deadline")).sum())
+    return len(df), with_deadline, len(df) - with_deadline
+
+
+@lru_cache(maxsize=32)
+def _reg_missing_rows(source: str, risk: str, mtime_ns: int) -> tuple:
+    """Filtered rows whose owner and/or deadline is blank."""
+    df = _cached_reg_frame(source, risk, mtime_ns)
+    missing = _blank(df, "owner") | _blank(df, "deadline")
+    return tuple(df[missing].to_dict("records"))
+
+
 def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
     """
     Handle structured regulation questions using the tagged regulatory CSV
@@ -663,38 +871,30 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
     if mode == "no_layer":
         return None
 
-    q = query.lower()
+    found = {m.group(1) for m in _REG_METRIC_RE.finditer(query.lower())}
 
     # We key off MAS 610–style wording and "suspicious" references
-    is_mas_610 = "mas 610" in q or "mas notice 610" in q
-    is_suspicious = "suspicious" in q
+    is_mas_610 = "mas 610" in found or "mas notice 610" in found
+    is_suspicious = "suspicious" in found
 
     if not (is_mas_610 and is_suspicious):
         return None
 
     source_pattern = "MAS Notice 610"  # will be used with .str.contains(case=False)
+    risk_pattern = "suspicious"  # substring match in risk_type
+    mtime_ns = _reg_csv_mtime()
 
     # ------------------------------------------------------------------
     # CASE 1:
     #  "How many suspicious transaction obligations under MAS 610
     #   have deadlines captured?"
     # ------------------------------------------------------------------
-    if (("how many" in q) or ("count" in q)) and ("deadline" in q or "deadlines" in q):
-        rows = query_regulations(
-            {
-                "source_document": source_pattern,
-                "risk_type": "suspicious",  # substring match in risk_type
-                # we want ALL suspicious rows, we'll count those with deadlines below
-            }
-        ) or []
-
-        total = len(rows)
-        with_deadline = 0
-        for r in rows:
-            dl = str(r.get("deadline", "")).strip()
-            if dl:
-                with_deadline += 1
-        without_deadline = total - with_deadline
+    if ("how many" in found or "count" in found) and "deadline" in found:
+        # we want ALL suspicious rows, counted by deadline presence
+        rows = list(_cached_reg_rows(source_pattern, risk_pattern, mtime_ns))
+        total, with_deadline, without_deadline = _reg_deadline_stats(
+            source_pattern, risk_pattern, mtime_ns
+        )
 
         if total == 0:
             answer = (
@@ -702,21 +902,24 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
                 "obligations under MAS Notice 610 matching this filter."
             )
         else:
-            example_bits = []
-            for r in rows[:3]:
-                pid = r.get("paragraph_id") or "(no id)"
-                reg = r.get("regulation") or r.get("paragraph_text") or ""
-                example_bits.append(f"- {pid}: {reg[:160]}")
+            example_bits = [
+                f"- {r.get('paragraph_id') or '(no id)'}: "
+                f"{(r.get('regulation') or r.get('paragraph_text') or '')[:160]}"
+                for r in rows[:3]
+            ]
 
-            examples_str = "\n".join(example_bits) if example_bits else ""
-            answer = (
+            parts = [
                 f"Under MAS Notice 610, the tagged regulatory data shows **{total}** "
-                f"suspicious-transaction obligations.\n\n"
-                f"- **With deadlines captured:** {with_deadline}\n"
-                f"- **Missing/blank deadlines:** {without_deadline}\n"
-            )
-            if examples_str:
-                answer += "\n**Examples (first few paragraphs):**\n" + examples_str
+                f"suspicious-transaction obligations.",
+                "",
+                f"- **With deadlines captured:** {with_deadline}",
+                f"- **Missing/blank deadlines:** {without_deadline}",
+                "",
+            ]
+            if example_bits:
+                parts.append("**Examples (first few paragraphs):**")
+                parts.extend(example_bits)
+            answer = "\n".join(parts)
 
         return {
             "answer": answer,
@@ -730,15 +933,10 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
     #  "From MAS 610, show suspicious transaction obligations and
     #   highlight where owner or deadline is missing."
     # ------------------------------------------------------------------
-    if ("show" in q or "list" in q) and "missing" in q and (
-        "owner" in q or "deadline" in q
+    if ("show" in found or "list" in found) and "missing" in found and (
+        "owner" in found or "deadline" in found
     ):
-        rows = query_regulations(
-            {
-                "source_document": source_pattern,
-                "risk_type": "suspicious",
-            }
-        ) or []
+        rows = list(_cached_reg_rows(source_pattern, risk_pattern, mtime_ns))
 
         if not rows:
             answer = (
@@ -752,15 +950,7 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
                 "tool_name": "query_regulations",
             }
 
-        missing_info = []
-        complete_info = []
-        for r in rows:
-            owner = str(r.get("owner", "")).strip()
-            deadline = str(r.get("deadline", "")).strip()
-            if not owner or not deadline:
-                missing_info.append(r)
-            else:
-                complete_info.append(r)
+        missing_info = _reg_missing_rows(source_pattern, risk_pattern, mtime_ns)
 
         total = len(rows)
         missing_count = len(missing_info)
@@ -776,14 +966,13 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
 
         if missing_info:
             lines.append("\n**Obligations with missing owner/deadline (first few):**")
-            for r in missing_info[:5]:
-                pid = r.get("paragraph_id") or "(no id)"
-                reg = r.get("regulation") or r.get("paragraph_text") or ""
-                owner = r.get("owner") or "(missing)"
-                deadline = r.get("deadline") or "(missing)"
-                lines.append(
-                    f"- {pid}: {reg[:160]} … | owner={owner}, deadline={deadline}"
-                )
+            lines.extend(
+                f"- {r.get('paragraph_id') or '(no id)'}: "
+                f"{(r.get('regulation') or r.get('paragraph_text') or '')[:160]} … | "
+                f"owner={_or_missing(r.get('owner'))}, "
+                f"deadline={_or_missing(r.get('deadline'))}"
+                for r in missing_info[:5]
+            )
 
         answer = "\n".join(lines)
         return {
@@ -802,298 +991,296 @@ def _reg_metric_answer(query: str, mode: str) -> Dict[str, Any] | None:
 # 6. WRITER NODE (EXPLICIT STAGE IN THE PIPELINE)
 # ============================================================
 
-def writer_node(intent: str, payload: Dict[str, Any]) -> str:
+# intent -> formatter for that intent's tool result
+_FORMATTERS = {
+    "PII_SEARCH": format_pii_results,
+    "AML_SEARCH": format_aml_results,
+    "REG_SEARCH": format_reg_results,
+    "SAR_DRAFT": format_sar_result,
+}
+
+# (intent, raw mode?) -> tool name reported in the trace
+_TOOL_NAMES = {
+    ("PII_SEARCH", True): "raw_search_pii",
+    ("PII_SEARCH", False): "search_pii_tool",
+    ("AML_SEARCH", True): "raw_search_aml",
+    ("AML_SEARCH", False): "search_aml_tool",
+    ("REG_SEARCH", True): "raw_search_reg",
+    ("REG_SEARCH", False): "search_regulations_tool",
+    ("SAR_DRAFT", True): "none",
+    ("SAR_DRAFT", False): "draft_sar_tool",
+}
+
+
+# Columns the Streamlit trace preview actually shows, per intent
+_PREVIEW_KEYS = {
+    "PII_SEARCH": ("message_id", "pii_entities", "risk_flag"),
+    "AML_SEARCH": ("transaction_id", "amount_sgd", "aml_tags", "risk_score"),
+    "REG_SEARCH": ("paragraph_id", "source_document", "owner", "deadline"),
+}
+PREVIEW_ROWS = 3
+
+
+def _project_preview(intent: str, hits: List[Any]) -> List[Any]:
+    """
+    First few hits cut down to the preview columns, so traces don't carry
+    full records (long original_text / narrative) just for display.
+    Rows without any of those keys are kept whole.
+    """
+    keys = _PREVIEW_KEYS.get(intent)
+    if keys is None:
+        return list(hits[:PREVIEW_ROWS])
+    out = []
+    for h in hits[:PREVIEW_ROWS]:
+        if isinstance(h, dict):
+            h = {k: h[k] for k in keys if k in h} or h
+        out.append(h)
+    return out
+
+
+def writer_node(intent: str, result: Dict[str, Any]) -> str:
     """
     Explicit writer stage so the graph is:
       router -> tools -> writer
 
     The writer is deterministic (no LLM), which is ideal for
     this audited banking demo and your golden test expectations.
+    `result` is the tool result for `intent`, passed straight through.
     """
-    if intent == "PII_SEARCH":
-        return format_pii_results(payload.get("pii", {}))
-    if intent == "AML_SEARCH":
-        return format_aml_results(payload.get("aml", {}))
-    if intent == "REG_SEARCH":
-        return format_reg_results(payload.get("reg", {}))
-    if intent == "SAR_DRAFT":
-        return format_sar_result(payload.get("sar", {}))
-
-    return "No results found for your query."
+    fmt = _FORMATTERS.get(intent)
+    if fmt is None:
+        return "No results found for your query."
+    return fmt(result)
 
 
 # ============================================================
 # 7. CORE ANSWER LOGIC USED BY ALL THREE AGENTS
 # ============================================================
 
-def core_answer(query: str, mode: str) -> str:
-    """
-    Shared logic for:
-      - without layer ("no_layer")
-      - with layer ("semantic_layer")
-      - with vector layer ("vector_layer")
-    """
-    intent = simple_intent_router(query)
+# Fixed baseline-mode SAR text, built once at import
+_SAR_NO_LAYER_DRAFT = (
+    "No SAR draft available for the requested transaction in this "
+    "baseline mode (no tagged AML semantic layer)."
+)
 
-    if intent == "OUT_OF_SCOPE":
-        return (
-            "Query out of scope for this demo — please ask about PII, AML high-risk "
-            "transactions, MAS 610 regulations, or SAR drafting in our synthetic dataset."
-        )
 
-    payload: Dict[str, Any] = {}
+def _dispatch(intent: str, query: str, mode: str) -> tuple:
+    """
+    Run the tool(s) for an already-routed, in-scope intent and write the answer.
+
+    Returns (answer, tool_name, hit_count, hits); core_answer keeps only the
+    answer, core_answer_with_trace turns the rest into its trace.
+    """
+    tool_name = _TOOL_NAMES.get((intent, mode == "no_layer"))
 
     # -------------------------
     # PII
     # -------------------------
     if intent == "PII_SEARCH":
-        payload["pii"] = _pii_results_for_mode(query, mode=mode)
-        return writer_node(intent, payload)
+        res = _pii_results_for_mode(query, mode=mode)
+        answer = writer_node(intent, res)
+        return answer, tool_name, res.get("count", 0), res.get("hits", [])
 
     # -------------------------
     # AML
     # -------------------------
     if intent == "AML_SEARCH":
-        payload["aml"] = _aml_results_for_mode(query, mode=mode)
-        return writer_node(intent, payload)
+        res = _aml_results_for_mode(query, mode=mode)
+        answer = writer_node(intent, res)
+        return answer, tool_name, res.get("count", 0), res.get("matches", [])
 
     # -------------------------
     # REGULATORY
     # -------------------------
     if intent == "REG_SEARCH":
         # First, try the structured reg metrics handler (MAS 610 suspicious, deadlines, etc.)
-        metric_result = _reg_metric_answer(query, mode=mode)
-        if metric_result is not None:
+        metric_res = _reg_metric_answer(query, mode=mode)
+        if metric_res is not None:
             # Directly return the crafted answer for those special metric queries
-            return metric_result["answer"]
+            return (
+                metric_res["answer"],
+                metric_res.get("tool_name", "query_regulations"),
+                metric_res.get("count", 0),
+                metric_res.get("matches", []),
+            )
 
         # Fallback: standard regulation search (as before)
-        payload["reg"] = _reg_results_for_mode(query, mode=mode)
-        return writer_node(intent, payload)
+        res = _reg_results_for_mode(query, mode=mode)
+        answer = writer_node(intent, res)
+        return answer, tool_name, res.get("count", 0), res.get("matches", [])
 
     # -------------------------
-    # SAR DRAFT (THIS IS WHERE WE CHANGE LOGIC)
+    # SAR DRAFT
     # -------------------------
     if intent == "SAR_DRAFT":
         tx_id = extract_tx_id(query) or "T028"
 
         if mode == "no_layer":
             # Baseline agent CANNOT auto-draft SAR — intentional limitation
-            sar = {
-                "transaction_id": tx_id,
-                "sar_draft": (
-                    "No SAR draft available for the requested transaction in this "
-                    "baseline mode (no tagged AML semantic layer)."
-                ),
-            }
+            sar = {"transaction_id": tx_id, "sar_draft": _SAR_NO_LAYER_DRAFT}
         else:
             # Semantic-layer agents use full tagged AML metadata
             sar = sar_draft_from_aml_tool(tx_id)
 
-        payload["sar"] = sar
-        return writer_node(intent, payload)
+        return writer_node(intent, sar), tool_name, 1, [sar]
 
-    return "No results found for your query."
+    return "No results found for your query.", None, 0, []
 
 
+def core_answer(query: str, mode: str) -> str:
+    """
+    Shared logic for:
+      - without layer ("no_layer")
+      - with layer ("semantic_layer")
+      - with vector layer ("vector_layer")
+    """
+    intent = simple_intent_router(query)
+
+    if intent == "OUT_OF_SCOPE":
+        return (
+            "Query out of scope for this demo — please ask about PII, AML high-risk "
+            "transactions, MAS 610 regulations, or SAR drafting in our synthetic dataset."
+        )
 
+    return _dispatch(intent, query, mode)[0]
 
 
 # ============================================================
 # 7b. CORE ANSWER WITH TRACE (FOR STREAMLIT / LOGGING)
 # ============================================================
 
-def core_answer_with_trace(query: str, mode: str) -> Dict[str, Any]:
-    """
-    Same as core_answer() but returns a trace object for Streamlit.
-    """
-    intent = simple_intent_router(query)
+@dataclass(slots=True)
+class Trace:
+    """What one agent call did; flattened into a dict only for Streamlit."""
 
-    trace = {
-        "intent": intent,
-        "mode": mode,
-        "tool_name": None,
-        "hit_count": 0,
-        "preview": [],
-    }
+    intent: str
+    mode: str
+    tool_name: str | None = None
+    hit_count: int = 0
+    preview: list = field(default_factory=list)
 
-    # -------------------------
-    # OUT OF SCOPE
-    # -------------------------
-    if intent == "OUT_OF_SCOPE":
+    def flat(self, answer: str) -> Dict[str, Any]:
         return {
-            "answer": (
-                "Query out of scope for this demo — please ask about PII, AML, "
-                "MAS 610 regulations, or SAR drafting."
-            ),
-            "trace": trace,
+            "answer": answer,
+            "intent": self.intent,
+            "mode": self.mode,
+            "tool_name": self.tool_name,
+            "hit_count": self.hit_count,
+            "preview": self.preview,
         }
 
-    # -------------------------
-    # PII
-    # -------------------------
-    if intent == "PII_SEARCH":
-        res = _pii_results_for_mode(query, mode)
-        trace["tool_name"] = "raw_search_pii" if mode == "no_layer" else "search_pii_tool"
-        trace["hit_count"] = res.get("count", 0)
-        trace["preview"] = res.get("hits", [])[:3]
 
-        answer = writer_node("PII_SEARCH", {"pii": res})
-        return {"answer": answer, "trace": trace}
+def core_answer_with_trace(query: str, mode: str) -> Dict[str, Any]:
+    """
+    Same as core_answer() but returns the trace dict Streamlit renders:
+    answer, intent, mode, tool_name, hit_count, preview, plus the Trace
+    itself under "trace".
+    """
+    answer, trace = _answer_and_trace(query, mode)
+    return {**trace.flat(answer), "trace": trace}
 
-    # -------------------------
-    # AML
-    # -------------------------
-    if intent == "AML_SEARCH":
-        res = _aml_results_for_mode(query, mode)
-        trace["tool_name"] = "raw_search_aml" if mode == "no_layer" else "search_aml_tool"
-        trace["hit_count"] = res.get("count", 0)
-        trace["preview"] = res.get("matches", [])[:3]
 
-        answer = writer_node("AML_SEARCH", {"aml": res})
-        return {"answer": answer, "trace": trace}
+def _answer_and_trace(query: str, mode: str) -> tuple[str, Trace]:
+    intent = simple_intent_router(query)
 
     # -------------------------
-    # REGULATIONS
+    # OUT OF SCOPE
     # -------------------------
-    if intent == "REG_SEARCH":
-        # Try metric-style regulation questions first (MAS 610 suspicious, deadlines, etc.)
-        metric_res = _reg_metric_answer(query, mode)
-        if metric_res is not None:
-            trace["tool_name"] = metric_res.get("tool_name", "query_regulations")
-            trace["hit_count"] = metric_res.get("count", 0)
-            trace["preview"] = metric_res.get("matches", [])[:3]
-            return {"answer": metric_res["answer"], "trace": trace}
+    if intent == "OUT_OF_SCOPE":
+        return (
+            "Query out of scope for this demo — please ask about PII, AML, "
+            "MAS 610 regulations, or SAR drafting."
+        ), Trace(intent, mode)
 
-        # Fallback: normal regulation search path
-        res = _reg_results_for_mode(query, mode)
-        trace["tool_name"] = "raw_search_reg" if mode == "no_layer" else "search_regulations_tool"
-        trace["hit_count"] = res.get("count", 0)
-        trace["preview"] = res.get("matches", [])[:3]
+    answer, tool_name, hit_count, hits = _dispatch(intent, query, mode)
+    return answer, Trace(
+        intent, mode, tool_name, hit_count, _project_preview(intent, hits)
+    )
 
-        answer = writer_node("REG_SEARCH", {"reg": res})
-        return {"answer": answer, "trace": trace}
 
-    # -------------------------
-    # SAR DRAFT
-    # -------------------------
-    if intent == "SAR_DRAFT":
-        tx_id = extract_tx_id(query) or "T028"
+# ============================================================
+# 8. PUBLIC FACTORY FUNCTIONS (USED BY TESTS & STREAMLIT)
+# ============================================================
 
-        if mode == "no_layer":
-            sar = {
-                "transaction_id": tx_id,
-                "sar_draft": (
-                    "No SAR draft available for the requested transaction in this "
-                    "baseline mode (no tagged AML semantic layer)."
-                ),
-            }
-            trace["tool_name"] = "none"
+# Conversation memory: a bounded deque of (role, message) per session.
+# Agents built with the same session_id share one history; without one,
+# each agent keeps its own. At most MEMORY_MAX_SESSIONS ids are kept; the
+# least recently used one is forgotten first.
+MEMORY_MAX_MESSAGES = 50
+MEMORY_MAX_SESSIONS = 256
+_SESSION_MEMS: "OrderedDict[str, deque]" = OrderedDict()
+_SESSION_MEMS_LOCK = threading.Lock()
+
+
+def _session_memory(session_id: str | None) -> deque:
+    if session_id is None:
+        return deque(maxlen=MEMORY_MAX_MESSAGES)
+    with _SESSION_MEMS_LOCK:
+        memory = _SESSION_MEMS.get(session_id)
+        if memory is None:
+            memory = _SESSION_MEMS[session_id] = deque(maxlen=MEMORY_MAX_MESSAGES)
+            while len(_SESSION_MEMS) > MEMORY_MAX_SESSIONS:
+                _SESSION_MEMS.popitem(last=False)
         else:
-            sar = sar_draft_from_aml_tool(tx_id)
-            trace["tool_name"] = "draft_sar_tool"
-
-        trace["hit_count"] = 1
-        trace["preview"] = [sar]
-
-        answer = writer_node("SAR_DRAFT", {"sar": sar})
-        return {"answer": answer, "trace": trace}
-
-    # -------------------------
-    # FALLBACK
-    # -------------------------
-    return {"answer": "No results found for your query.", "trace": trace}
-
+            _SESSION_MEMS.move_to_end(session_id)
+        return memory
 
 
-    # -------------------------
-    # DEFAULT
-    # -------------------------
-    return {
-        "answer": "No results found for your query.",
-        "trace": trace,
-    }
-
-
-    # -------------------------
-    return {
-        "answer": "No results found for your query.",
-        "trace": trace,
-    }
-
-
-
-# ============================================================
-# 8. PUBLIC FACTORY FUNCTIONS (USED BY TESTS & STREAMLIT)
-# ============================================================
+def reset_session_memory(session_id: str | None = None) -> None:
+    """Forget one session's conversation (every session when None)."""
+    with _SESSION_MEMS_LOCK:
+        if session_id is None:
+            _SESSION_MEMS.clear()
+        else:
+            _SESSION_MEMS.pop(session_id, None)
 
-def create_agent_without_layer():
+def create_agent_without_layer(session_id: str | None = None):
     """
     Baseline agent (no semantic layer).
 
     Uses raw_* tools, which search directly on raw CSVs without tagged metadata.
     Output format is the same as the other agents, but content is weaker/approximate.
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> str:
-        # ConversationBufferMemory in langchain_classic uses chat_memory
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         answer = core_answer(query, mode="no_layer")
-        memory.chat_memory.add_ai_message(answer)
+        memory.append(("ai", answer))
         return answer
 
     return run
 
 
-def create_agent_with_layer():
+def create_agent_with_layer(session_id: str | None = None):
     """
     "With Layer" agent.
 
     Uses tagged_* tools over the semantic layer (tagged CSVs).
-    We optionally touch semantic_layer metrics for the demo story.
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> str:
-        # Best-effort: touch semantic layer but ignore errors
-        try:
-            _ = query_semantic_layer(query)
-        except Exception:
-            pass
-
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         answer = core_answer(query, mode="semantic_layer")
-        memory.chat_memory.add_ai_message(answer)
+        memory.append(("ai", answer))
         return answer
 
     return run
 
 
-def create_agent_with_vector_layer():
+def create_agent_with_vector_layer(session_id: str | None = None):
     """
     "With Vector-Enhanced Layer" agent.
 
-    Uses the same tagged_* tools for final answer, but also
-    triggers vector-layer search (FAISS) for the demo storyline.
+    Uses the same tagged_* tools for the final answer (vector_layer mode).
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> str:
-        # Best-effort: touch semantic + vector layer but ignore errors
-        try:
-            _ = query_semantic_layer(query)
-        except Exception:
-            pass
-
-        try:
-            _ = query_vector_layer(query)
-        except Exception:
-            pass
-
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         answer = core_answer(query, mode="vector_layer")
-        memory.chat_memory.add_ai_message(answer)
+        memory.append(("ai", answer))
         return answer
 
     return run
@@ -1103,96 +1290,47 @@ def create_agent_with_vector_layer():
 # 9. FACTORIES WITH TRACE (FOR STREAMLIT UI)
 # ============================================================
 
-def create_agent_without_layer_with_trace():
+def create_agent_without_layer_with_trace(session_id: str | None = None):
     """
     Baseline agent (no semantic layer) but returns a trace dict for Streamlit.
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> Dict[str, Any]:
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         result = core_answer_with_trace(query, mode="no_layer")
-        answer = result["answer"]
-        t = result["trace"] or {}
-
-        flat = {
-            "answer": answer,
-            "intent": t.get("intent"),
-            "mode": t.get("mode") or "no_layer",
-            "tool_name": t.get("tool_name"),
-            "hit_count": t.get("hit_count", 0),
-            "preview": t.get("preview", []),
-        }
-        memory.chat_memory.add_ai_message(answer)
-        return flat
+        memory.append(("ai", result["answer"]))
+        return result
 
     return run
 
 
-def create_agent_with_layer_with_trace():
+def create_agent_with_layer_with_trace(session_id: str | None = None):
     """
     Semantic-layer agent (tagged CSVs) with trace dict for Streamlit.
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> Dict[str, Any]:
-        # Best-effort: touch semantic layer for metrics, ignore errors
-        try:
-            _ = query_semantic_layer(query)
-        except Exception:
-            pass
-
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         result = core_answer_with_trace(query, mode="semantic_layer")
-        answer = result["answer"]
-        t = result["trace"] or {}
-
-        flat = {
-            "answer": answer,
-            "intent": t.get("intent"),
-            "mode": t.get("mode") or "semantic_layer",
-            "tool_name": t.get("tool_name"),
-            "hit_count": t.get("hit_count", 0),
-            "preview": t.get("preview", []),
-        }
-        memory.chat_memory.add_ai_message(answer)
-        return flat
+        memory.append(("ai", result["answer"]))
+        return result
 
     return run
 
 
-def create_agent_with_vector_layer_with_trace():
+def create_agent_with_vector_layer_with_trace(session_id: str | None = None):
     """
     Vector-enhanced semantic-layer agent (dbt + FAISS) with trace dict.
     """
-    memory = ConversationBufferMemory()
+    memory = _session_memory(session_id)
 
     def run(query: str) -> Dict[str, Any]:
-        # Best-effort: touch semantic + vector layer but ignore errors
-        try:
-            _ = query_semantic_layer(query)
-        except Exception:
-            pass
-        try:
-            _ = query_vector_layer(query)
-        except Exception:
-            pass
-
-        memory.chat_memory.add_user_message(query)
+        memory.append(("user", query))
         result = core_answer_with_trace(query, mode="vector_layer")
-        answer = result["answer"]
-        t = result["trace"] or {}
-
-        flat = {
-            "answer": answer,
-            "intent": t.get("intent"),
-            "mode": t.get("mode") or "vector_layer",
-            "tool_name": t.get("tool_name"),
-            "hit_count": t.get("hit_count", 0),
-            "preview": t.get("preview", []),
-        }
-        memory.chat_memory.add_ai_message(answer)
-        return flat
+        memory.append(("ai", result["answer"]))
+        return result
 
     return run
 
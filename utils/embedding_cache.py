@@ -0,0 +1,96 @@
+import os
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+# ---------------------------------------------------------
+# Disk-backed embedding cache (sqlite, keyed by content hash)
+# ---------------------------------------------------------
+
+CACHE_PATH = os.path.join("outputs", "embedding_cache.sqlite")
+
+# One open connection per thread (sqlite connections can't cross threads),
+# so each lookup skips the open + schema check
+_local = threading.local()
+
+# float32 blobs; a new table name so rows written as float16 by earlier
+# versions are never read back with the wrong width
+_TABLE = "embeddings_f32"
+
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == CACHE_PATH:
+        return conn
+
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH)
+    # WAL lets Streamlit threads read while a build is writing
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {_TABLE} (hash TEXT PRIMARY KEY, vec BLOB)"
+    )
+    _local.conn, _local.path = conn, CACHE_PATH
+    return conn
+
+
+def text_hash(model: str, text: str) -> str:
+    """
+    Cache key for one (model, text) pair.
+    blake2b with a 16-byte digest is faster than sha256 and plenty unique here.
+    """
+    return hashlib.blake2b(
+        f"{model}::{text}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def get(h: str) -> np.ndarray | None:
+    """Return the cached float32 vector for hash `h`, or None."""
+    return get_many([h]).get(h)
+
+
+def put(h: str, vec: np.ndarray) -> None:
+    """Store one vector under hash `h`."""
+    put_many([(h, vec)])
+
+
+def get_many(hashes: list[str]) -> dict[str, np.ndarray]:
+    """
+    Look up several hashes in one query.
+    Returns {hash: float32 vector} for the hashes that are cached.
+    """
+    if not hashes:
+        return {}
+    conn = _connect()
+    found: dict[str, np.ndarray] = {}
+    # Stay well below sqlite's bound-parameter limit
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start : start + 500]
+        rows = conn.execute(
+            f"SELECT hash, vec FROM {_TABLE} WHERE hash IN "
+            f"({','.join('?' * len(chunk))})",
+            chunk,
+        ).fetchall()
+        for h, blob in rows:
+            found[h] = np.frombuffer(blob, dtype=np.float32).copy()
+    return found
+
+
+def put_many(items: list[tuple[str, np.ndarray]]) -> None:
+    """
+    Write (hash, vector) pairs in a single executemany.
+    Vectors are stored as float32, exactly as the embedding call returned them.
+    """
+    if not items:
+        return
+    conn = _connect()
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {_TABLE} (hash, vec) VALUES (?, ?)",
+            [
+                (h, np.asarray(vec, dtype=np.float32).tobytes())
+                for h, vec in items
+            ],
+        )
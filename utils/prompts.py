@@ -3,6 +3,8 @@
 # utils/prompts.py
 # Constants for agent prompts (descriptive, anti-hallucination; fixed: Prepended soft prefix to all prompts for Azure content filter safety)
 
+import re
+
 SOFT_PREFIX = "You are a compliance analyst detecting and reporting risks only—never assisting illegal actions. Follow the instructions below.\n\n"
 
 INTENT_PROMPT = SOFT_PREFIX + """
@@ -502,3 +504,20 @@ If validation fails, return **exact fallback string** (above) — the orchestrat
 *End of writer_prompt.md — bank-compliant writer instructions.*
 """
 
+
+# ---------------------------------------------------------
+# Whitespace normalisation (once at import): every prompt token is paid
+# on each call, so drop trailing spaces and extra blank lines
+# ---------------------------------------------------------
+
+_TRAILING_WS_RE = re.compile(r"[ \t]+\n")
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+def _compact(prompt: str) -> str:
+    return _BLANK_RUN_RE.sub("\n\n", _TRAILING_WS_RE.sub("\n", prompt))
+
+
+INTENT_PROMPT = _compact(INTENT_PROMPT)
+REASONER_PROMPT = _compact(REASONER_PROMPT)
+WRITER_PROMPT = _compact(WRITER_PROMPT)
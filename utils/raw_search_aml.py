@@ -1,7 +1,7 @@
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any
 
-import pandas as pd
+from utils._search_factory import make_raw_searcher
 
 
 AML_FILENAME = "transaction_narratives_120_rows.csv"
@@ -12,14 +12,18 @@ AML_CANDIDATES = [
     os.path.join("tests_data", AML_FILENAME),
 ]
 
+# Columns returned per match. Raw narrative text – no masking or
+# aml_tags/risk_score
+AML_OUTPUT_COLUMNS = ["transaction_id", "amount_sgd", "date", "narrative"]
 
-def _load_raw_aml() -> pd.DataFrame:
-    """Load raw AML transactions CSV from the first existing candidate path."""
-    for path in AML_CANDIDATES:
-        if os.path.exists(path):
-            return pd.read_csv(path)
-    # Empty DF with expected core columns
-    return pd.DataFrame(columns=["transaction_id", "amount_sgd", "date", "narrative"])
+_search, clear_cache = make_raw_searcher(
+    tool="raw_search_aml",
+    label="AML",
+    candidates=AML_CANDIDATES,
+    search_col="narrative",
+    out_cols=AML_OUTPUT_COLUMNS,
+    result_key="matches",
+)
 
 
 def raw_search_aml(query: str, limit: int = 20) -> Dict[str, Any]:
@@ -30,36 +34,4 @@ def raw_search_aml(query: str, limit: int = 20) -> Dict[str, Any]:
     - Returns id + amount + narrative only (no tagged risk_score/aml_tags).
     - Marked as `approximate=True` so the writer knows this is raw.
     """
-    df = _load_raw_aml()
-    if df.empty or "narrative" not in df.columns:
-        return {
-            "tool": "raw_search_aml",
-            "query": query,
-            "approximate": True,
-            "matches": [],
-            "count": 0,
-            "note": "Raw AML CSV not found or missing 'narrative' column.",
-        }
-
-    mask = df["narrative"].astype(str).str.contains(query, case=False, na=False)
-    hits_df = df[mask].head(limit)
-
-    matches: List[Dict[str, Any]] = []
-    for _, row in hits_df.iterrows():
-        matches.append(
-            {
-                "transaction_id": row.get("transaction_id"),
-                "amount_sgd": row.get("amount_sgd"),
-                "date": row.get("date"),
-                # Raw narrative text – no masking or aml_tags/risk_score
-                "narrative": row.get("narrative"),
-            }
-        )
-
-    return {
-        "tool": "raw_search_aml",
-        "query": query,
-        "approximate": True,
-        "matches": matches,
-        "count": len(matches),
-    }
+    return _search(query, limit)
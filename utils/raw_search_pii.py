@@ -1,7 +1,7 @@
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any
 
-import pandas as pd
+from utils._search_factory import make_raw_searcher
 
 
 # Filenames for raw PII communications
@@ -14,14 +14,18 @@ PII_CANDIDATES = [
     os.path.join("tests_data", PII_FILENAME),
 ]
 
+# Columns returned per hit; they may or may not exist in the raw CSV
+# (missing ones come back as None). Raw text only – no masking / entities / risk
+PII_OUTPUT_COLUMNS = ["message_id", "channel", "text"]
 
-def _load_raw_pii() -> pd.DataFrame:
-    """Load raw PII communications CSV from the first existing candidate path."""
-    for path in PII_CANDIDATES:
-        if os.path.exists(path):
-            return pd.read_csv(path)
-    # If nothing found, return empty DF with expected columns so we don't crash
-    return pd.DataFrame(columns=["message_id", "channel", "text"])
+_search, clear_cache = make_raw_searcher(
+    tool="raw_search_pii",
+    label="PII",
+    candidates=PII_CANDIDATES,
+    search_col="text",
+    out_cols=PII_OUTPUT_COLUMNS,
+    result_key="hits",
+)
 
 
 def raw_search_pii(query: str, limit: int = 20) -> Dict[str, Any]:
@@ -32,36 +36,4 @@ def raw_search_pii(query: str, limit: int = 20) -> Dict[str, Any]:
     - Returns minimal metadata so the writer can still format something.
     - Marked as `approximate=True` so we can distinguish this from tagged tools.
     """
-    df = _load_raw_pii()
-    if df.empty or "text" not in df.columns:
-        return {
-            "tool": "raw_search_pii",
-            "query": query,
-            "approximate": True,
-            "hits": [],
-            "count": 0,
-            "note": "Raw PII CSV not found or missing 'text' column.",
-        }
-
-    mask = df["text"].astype(str).str.contains(query, case=False, na=False)
-    hits_df = df[mask].head(limit)
-
-    hits: List[Dict[str, Any]] = []
-    for _, row in hits_df.iterrows():
-        hits.append(
-            {
-                # These may or may not exist in the raw CSV; .get-style access is safe
-                "message_id": row.get("message_id"),
-                "channel": row.get("channel"),
-                # Raw text only – no masking / entities / risk here
-                "text": row.get("text"),
-            }
-        )
-
-    return {
-        "tool": "raw_search_pii",
-        "query": query,
-        "approximate": True,
-        "hits": hits,
-        "count": len(hits),
-    }
+    return _search(query, limit)
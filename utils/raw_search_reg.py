@@ -1,7 +1,7 @@
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any
 
-import pandas as pd
+from utils._search_factory import make_raw_searcher
 
 
 REG_FILENAME = "regulatory_paragraphs_45_rows.csv"
@@ -12,16 +12,19 @@ REG_CANDIDATES = [
     os.path.join("tests_data", REG_FILENAME),
 ]
 
+# Columns returned per match (no owner / business_unit / deadline tagging)
+REG_OUTPUT_COLUMNS = [
+    "paragraph_id", "source_document", "regulation", "article", "paragraph_text"
+]
 
-def _load_raw_reg() -> pd.DataFrame:
-    """Load raw regulatory paragraphs CSV from the first existing candidate path."""
-    for path in REG_CANDIDATES:
-        if os.path.exists(path):
-            return pd.read_csv(path)
-    # Empty DF with expected columns
-    return pd.DataFrame(
-        columns=["paragraph_id", "source_document", "regulation", "article", "paragraph_text"]
-    )
+_search, clear_cache = make_raw_searcher(
+    tool="raw_search_reg",
+    label="REG",
+    candidates=REG_CANDIDATES,
+    search_col="paragraph_text",
+    out_cols=REG_OUTPUT_COLUMNS,
+    result_key="matches",
+)
 
 
 def raw_search_reg(query: str, limit: int = 20) -> Dict[str, Any]:
@@ -32,36 +35,4 @@ def raw_search_reg(query: str, limit: int = 20) -> Dict[str, Any]:
     - Returns id + source + regulation + article + paragraph_text.
     - No owner / business_unit / deadline tagging here.
     """
-    df = _load_raw_reg()
-    if df.empty or "paragraph_text" not in df.columns:
-        return {
-            "tool": "raw_search_reg",
-            "query": query,
-            "approximate": True,
-            "matches": [],
-            "count": 0,
-            "note": "Raw REG CSV not found or missing 'paragraph_text' column.",
-        }
-
-    mask = df["paragraph_text"].astype(str).str.contains(query, case=False, na=False)
-    hits_df = df[mask].head(limit)
-
-    matches: List[Dict[str, Any]] = []
-    for _, row in hits_df.iterrows():
-        matches.append(
-            {
-                "paragraph_id": row.get("paragraph_id"),
-                "source_document": row.get("source_document"),
-                "regulation": row.get("regulation"),
-                "article": row.get("article"),
-                "paragraph_text": row.get("paragraph_text"),
-            }
-        )
-
-    return {
-        "tool": "raw_search_reg",
-        "query": query,
-        "approximate": True,
-        "matches": matches,
-        "count": len(matches),
-    }
+    return _search(query, limit)
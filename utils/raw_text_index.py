@@ -0,0 +1,83 @@
+import re
+
+import numpy as np
+
+# ---------------------------------------------------------
+# Inverted token index shared by the raw_search_* modules
+# ---------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Rows substring-checked per step; a dense match stops after the first block
+_MIN_BLOCK = 256
+
+
+def build_token_index(texts: np.ndarray) -> dict[str, set[int]]:
+    """
+    token -> set(row positions), built once per CSV version from the
+    pre-lowercased search column.
+    """
+    index: dict[str, set[int]] = {}
+    for pos, text in enumerate(texts):
+        for tok in set(_TOKEN_RE.findall(text)):
+            index.setdefault(tok, set()).add(pos)
+    return index
+
+
+def match_positions(
+    texts: np.ndarray, index: dict[str, set[int]], q: str, limit: int
+) -> tuple[int, ...]:
+    """
+    Row positions (in file order, at most `limit`) whose text contains the
+    lowercased query `q` as a literal substring.
+
+    Query tokens narrow the rows first: a token may sit inside a longer word
+    ("pay" in "payment"), so each one maps to the union of the postings of
+    every indexed token containing it, and the posting sets are intersected.
+    Only the surviving rows get the substring check. Queries without any
+    word characters fall back to scanning every row.
+    """
+    tokens = set(_TOKEN_RE.findall(q))
+    if not tokens:
+        return _first_hits(texts, np.arange(len(texts)), q, limit)
+
+    rows: set[int] | None = None
+    # Rarest-looking (longest) token first keeps the intersection small
+    for tok in sorted(tokens, key=len, reverse=True):
+        posting = index.get(tok, set()).union(
+            *(p for word, p in index.items() if tok in word and word != tok)
+        )
+        rows = posting if rows is None else rows & posting
+        if not rows:
+            return ()
+
+    cand = np.fromiter(sorted(rows), dtype=np.intp, count=len(rows))
+    return _first_hits(texts, cand, q, limit)
+
+
+def _first_hits(
+    texts: np.ndarray, rows: np.ndarray, q: str, limit: int
+) -> tuple[int, ...]:
+    """
+    First `limit` of `rows` containing `q`, checked block by block.
+
+    np.char.find is the only substring check. Arrow's match_substring was
+    tried and not adopted: pyarrow is optional here (not in requirements),
+    so results would depend on what is installed, and on the 45-120 row
+    CSVs the token prefilter leaves only a few rows to check either way.
+    A numba byte scan was not adopted for the same reasons (numba is not a
+    dependency, and JIT warm-up outweighs a scan this small).
+    """
+    hits = []
+    found = 0
+    step = max(limit, _MIN_BLOCK)
+    for start in range(0, len(rows), step):
+        block = rows[start : start + step]
+        hit = block[np.char.find(texts[block], q) >= 0]
+        hits.append(hit)
+        found += len(hit)
+        if found >= limit:
+            break
+    if not hits:
+        return ()
+    return tuple(np.concatenate(hits)[:limit].tolist())
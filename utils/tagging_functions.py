@@ -4,14 +4,19 @@ from dotenv import load_dotenv
 import os
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils._retry import retry_delay
 
 load_dotenv()
 
-# Azure OpenAI client
+# Azure OpenAI client. SDK retries are off: call_azure_function has its own
+# retry loop, and stacking both multiplies the requests sent during a 429
 client = AzureOpenAI(
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
     api_key=os.getenv("OPENAI_API_KEY"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION", os.getenv("OPENAI_API_VERSION")),
+    max_retries=0,
 )
 
 deployment = os.getenv("DEPLOYMENT")
@@ -93,9 +98,54 @@ sar_schema = {
     },
 }
 
+# tools / tool_choice request payloads per schema name, built once here
+# rather than on every row's request
+_TOOLS = {
+    s["name"]: [{"type": "function", "function": s}]
+    for s in (pii_schema, aml_schema, reg_schema, sar_schema)
+}
+_TOOL_CHOICE = {
+    name: {"type": "function", "function": {"name": name}} for name in _TOOLS
+}
+
 # =============== TAGGING CORE CALL ===============
 
+# Rows tagged concurrently per DataFrame; each call is a blocking HTTPS
+# request, so threads overlap the round-trips. Kept low because taggers may
+# run side by side (test_agent.py runs all three), which multiplies the
+# calls in flight against one deployment (override with TAG_MAX_WORKERS).
+TAG_MAX_WORKERS = int(os.getenv("TAG_MAX_WORKERS", "4") or 4)
+
+# Completion budget per schema. The REG tool call is a handful of short
+# fields; the PII / AML calls echo the masked input text back, so they keep
+# the full budget (a truncated tool call is unparseable JSON).
+DEFAULT_MAX_TOKENS = 500
+MAX_TOKENS = {
+    "tag_regulatory_obligation": 250,
+}
+
+
+def _map_rows(tag_row, df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """
+    Apply `tag_row` to each row concurrently; results keep row order.
+    Rows are plain dicts of just `columns`, built in one to_dict pass.
+    """
+    if df.empty:
+        return pd.DataFrame([])
+    rows = df[columns].to_dict("records")
+    with ThreadPoolExecutor(
+        max_workers=min(TAG_MAX_WORKERS, len(rows)), thread_name_prefix="tag"
+    ) as pool:
+        return pd.DataFrame(list(pool.map(tag_row, rows)))
+
+
 def call_azure_function(text: str, schema: dict, system_prompt: str):
+    name = schema["name"]
+    tools, tool_choice = _TOOLS.get(name), _TOOL_CHOICE.get(name)
+    if tools is None or tools[0]["function"] is not schema:
+        # Schema not defined above: build its payloads for this call
+        tools = [{"type": "function", "function": schema}]
+        tool_choice = {"type": "function", "function": {"name": name}}
     for attempt in range(3):
         try:
             response = client.chat.completions.create(
@@ -104,17 +154,17 @@ def call_azure_function(text: str, schema: dict, system_prompt: str):
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": text},
                 ],
-                tools=[{"type": "function", "function": schema}],
-                tool_choice={"type": "function", "function": {"name": schema["name"]}},
+                tools=tools,
+                tool_choice=tool_choice,
                 temperature=0.0,
-                max_tokens=500,
+                max_tokens=MAX_TOKENS.get(schema["name"], DEFAULT_MAX_TOKENS),
             )
             result = response.choices[0].message.tool_calls[0].function.arguments
             return json.loads(result)
         except Exception as e:
-            time.sleep(1)
             if attempt == 2:
                 return {"error": str(e)}
+            time.sleep(retry_delay(e, attempt))
     return {"error": "max retries"}
 
 
@@ -193,16 +243,16 @@ Return:
   - risk_flag: one of ["Low", "Medium", "High", "Critical"] exactly.
 """
 
-    results = []
-    for _, row in df.iterrows():
+    def tag_row(row: dict) -> dict:
         text = f"Message ID: {row['message_id']}\nText: {row['text']}"
         result = call_azure_function(text, pii_schema, system)
         result["original_text"] = row["text"]
         # Keep message_id for convenience if model didn't echo it
         if "message_id" not in result:
             result["message_id"] = str(row.get("message_id", ""))
-        results.append(result)
-    return pd.DataFrame(results)
+        return result
+
+    return _map_rows(tag_row, df, ["message_id", "text"])
 
 
 def tag_aml_transactions(df: pd.DataFrame) -> pd.DataFrame:
@@ -211,8 +261,8 @@ def tag_aml_transactions(df: pd.DataFrame) -> pd.DataFrame:
         "crypto, gambling, trade-based laundering. Score risk_score between 0 and 10. "
         "Explain briefly why in 'explanation'."
     )
-    results = []
-    for _, row in df.iterrows():
+
+    def tag_row(row: dict) -> dict:
         text = (
             f"Transaction ID: {row['transaction_id']}\n"
             f"Amount: {row['amount_sgd']} SGD\n"
@@ -224,8 +274,9 @@ def tag_aml_transactions(df: pd.DataFrame) -> pd.DataFrame:
         result["date"] = row["date"]
         if "transaction_id" not in result:
             result["transaction_id"] = str(row.get("transaction_id", ""))
-        results.append(result)
-    return pd.DataFrame(results)
+        return result
+
+    return _map_rows(tag_row, df, ["transaction_id", "amount_sgd", "date", "narrative"])
 
 
 def tag_regulatory_obligations(df: pd.DataFrame) -> pd.DataFrame:
@@ -235,8 +286,8 @@ def tag_regulatory_obligations(df: pd.DataFrame) -> pd.DataFrame:
         "business_unit (owner teams), and owner. Use realistic owners such as "
         "Compliance, MLRO, Operations, etc."
     )
-    results = []
-    for _, row in df.iterrows():
+
+    def tag_row(row: dict) -> dict:
         text = (
             f"Paragraph ID: {row['paragraph_id']}\n"
             f"Source: {row['source_document']}\n"
@@ -248,8 +299,9 @@ def tag_regulatory_obligations(df: pd.DataFrame) -> pd.DataFrame:
             result["paragraph_id"] = str(row.get("paragraph_id", ""))
         if "source_document" not in result:
             result["source_document"] = str(row.get("source_document", ""))
-        results.append(result)
-    return pd.DataFrame(results)
+        return result
+
+    return _map_rows(tag_row, df, ["paragraph_id", "source_document", "paragraph_text"])
 
 
 # Export SAR schema for agent